@@ -0,0 +1,448 @@
+import asyncio
+import re
+import struct
+import warnings
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+# Removed from the standard library in Python 3.13, where the audioop-lts package provides the same module
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import audioop
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_END = re.compile(r"\n\s*\n")
+
+# Size written into the headers of a WAV stream whose length is not known yet
+WAV_STREAMING_SIZE = 0xFFFFFFFF
+
+Stitcher = Callable[[int, bytes], bytes]
+
+OGG_CONTINUED = 0x01
+OGG_BOS = 0x02
+OGG_EOS = 0x04
+# Granule position of pages on which no packet ends
+OGG_NO_GRANULE = -1
+
+
+def ogg_crc_table() -> List[int]:
+    table = []
+
+    for byte in range(256):
+        crc = byte << 24
+
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+
+        table.append(crc & 0xFFFFFFFF)
+
+    return table
+
+
+OGG_CRC_TABLE = ogg_crc_table()
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Splits a text into chunks of whole sentences with at most max_chars characters. Paragraphs always start a new chunk
+    and a sentence longer than max_chars becomes a chunk of its own.
+    """
+    chunks = []
+
+    for paragraph in PARAGRAPH_END.split(text):
+        current = ""
+
+        for sentence in SENTENCE_END.split(paragraph.strip()):
+            if not sentence:
+                continue
+
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+
+        if current:
+            chunks.append(current)
+
+    return chunks
+
+
+def strip_id3(segment: bytes) -> bytes:
+    if segment[:3] != b"ID3" or len(segment) < 10:
+        return segment
+
+    # The tag size is stored as a syncsafe integer, seven bits per byte
+    size = (segment[6] << 21) | (segment[7] << 14) | (segment[8] << 7) | segment[9]
+    footer = 10 if segment[5] & 0x10 else 0
+    return segment[10 + size + footer:]
+
+
+def parse_wav(segment: bytes) -> Tuple[bytes, bytes]:
+    """
+    Returns the fmt chunk and the sample data of a RIFF WAV file.
+    """
+    if segment[:4] != b"RIFF" or segment[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF WAV file")
+
+    fmt, data = None, b""
+    offset = 12
+
+    while offset + 8 <= len(segment):
+        chunk_id, size = segment[offset:offset + 4], struct.unpack("<I", segment[offset + 4:offset + 8])[0]
+        body = segment[offset + 8:offset + 8 + size]
+
+        if chunk_id == b"fmt ":
+            fmt = body
+        elif chunk_id == b"data":
+            data = body
+
+        # Chunks are padded to an even size
+        offset += 8 + size + (size & 1)
+
+    if fmt is None:
+        raise ValueError("WAV file without fmt chunk")
+
+    return fmt, data
+
+
+def wav_header(fmt: bytes, data_size: int | None) -> bytes:
+    riff_size = WAV_STREAMING_SIZE if data_size is None else 4 + 8 + len(fmt) + 8 + data_size
+    data_size = WAV_STREAMING_SIZE if data_size is None else data_size
+    return (
+        b"RIFF" + struct.pack("<I", riff_size) + b"WAVE" +
+        b"fmt " + struct.pack("<I", len(fmt)) + fmt +
+        b"data" + struct.pack("<I", data_size)
+    )
+
+
+def stitch_mp3(index: int, segment: bytes) -> bytes:
+    # MP3 frames can simply be concatenated, only the tags in front of later segments have to go
+    return segment if index == 0 else strip_id3(segment)
+
+
+def stitch_wav(index: int, segment: bytes) -> bytes:
+    fmt, data = parse_wav(segment)
+    return wav_header(fmt, None) + data if index == 0 else data
+
+
+def stitch_pcm(index: int, segment: bytes) -> bytes:
+    return segment
+
+
+def ogg_crc(data: bytes) -> int:
+    # Unreflected CRC-32 without initial value and final xor, which differs from zlib's
+    crc = 0
+
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+
+    return crc
+
+
+def split_ogg_pages(segment: bytes) -> List[bytes]:
+    pages = []
+    offset = 0
+
+    while offset < len(segment):
+        if segment[offset:offset + 4] != b"OggS" or len(segment) < offset + 27:
+            raise ValueError("Not an Ogg stream")
+
+        header_size = 27 + segment[offset + 26]
+        page_size = header_size + sum(segment[offset + 27:offset + header_size])
+        pages.append(segment[offset:offset + page_size])
+        offset += page_size
+
+    return pages
+
+
+class OggStitcher:
+    """
+    Joins the Ogg Opus segments of one response into a single logical stream. Chained streams are valid Ogg, but
+    most players stop at the end of the first one. The pages of later segments are renumbered into the stream of the
+    first segment, their headers are dropped and their granule positions continue where the previous segment ended.
+
+    The segments have to be encoded with the same settings. The pre-skip of a later segment is not removed, a few
+    milliseconds of encoder warm-up are played at every chunk boundary.
+    """
+
+    # OpusHead and OpusTags, the audio starts on a fresh page after them
+    HEADER_PACKETS = 2
+
+    def __init__(self, segments: int):
+        self.segments = segments
+        self.serial = None
+        self.sequence = 0
+        self.granule_offset = 0
+
+    def __call__(self, index: int, segment: bytes) -> bytes:
+        pages = split_ogg_pages(segment)
+        headers_left = 0 if index == 0 else self.HEADER_PACKETS
+        last_granule = 0
+        stitched = []
+
+        for page_idx, page in enumerate(pages):
+            if headers_left > 0:
+                # Header packets end with a lacing value below 255
+                headers_left -= sum(1 for size in page[27:27 + page[26]] if size < 255)
+                continue
+
+            header_type, granule, serial = struct.unpack_from("<BqI", page, 5)
+
+            if self.serial is None:
+                self.serial = serial
+
+            header_type &= ~OGG_EOS if index == 0 else ~(OGG_BOS | OGG_EOS)
+
+            if index == self.segments - 1 and page_idx == len(pages) - 1:
+                header_type |= OGG_EOS
+
+            if granule != OGG_NO_GRANULE:
+                last_granule = granule
+                granule += self.granule_offset
+
+            page = bytearray(page)
+            struct.pack_into("<BqIII", page, 5, header_type, granule, self.serial, self.sequence, 0)
+            struct.pack_into("<I", page, 22, ogg_crc(page))
+            stitched.append(bytes(page))
+            self.sequence += 1
+
+        self.granule_offset += last_granule
+        return b"".join(stitched)
+
+
+async def synthesize_chunked(
+        chunks: List[str],
+        synthesize: Callable[[str], Awaitable[bytes]],
+        parallelism: int,
+        create_stitcher: Callable[[int], Stitcher],
+) -> AsyncIterator[bytes]:
+    """
+    Synthesizes the chunks with at most parallelism requests at once and yields the stitched audio in order. Every
+    segment is yielded as soon as it and all segments before it are done, so playback can start with the first one.
+    """
+    if len(chunks) == 1:
+        yield await synthesize(chunks[0])
+        return
+
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def run(chunk: str) -> bytes:
+        async with semaphore:
+            return await synthesize(chunk)
+
+    tasks = [asyncio.ensure_future(run(chunk)) for chunk in chunks]
+    stitch = create_stitcher(len(chunks))
+
+    try:
+        for idx, task in enumerate(tasks):
+            yield stitch(idx, await task)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class PcmResampler:
+    """
+    Resamples 16 bit mono PCM chunk by chunk, the filter state carries over from one chunk to the next.
+    """
+
+    def __init__(self, from_rate: int, to_rate: int):
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.state = None
+        self.remainder = b""
+
+    def convert(self, chunk: bytes) -> bytes:
+        # Chunks may end in the middle of a sample
+        data = self.remainder + chunk
+        usable = len(data) - len(data) % 2
+        self.remainder = data[usable:]
+        converted, self.state = audioop.ratecv(data[:usable], 2, 1, self.from_rate, self.to_rate, self.state)
+        return converted
+
+
+async def convert_stream(segments: AsyncIterator[bytes], convert: Callable[[bytes], bytes]) -> AsyncIterator[bytes]:
+    async for segment in segments:
+        converted = convert(segment)
+
+        if converted:
+            yield converted
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str
+    media_type: str
+    # Creates the stitcher of one response from its number of segments, stitchers may keep state between segments
+    create_stitcher: Callable[[int], Stitcher]
+    # Name of the matching SpeechSynthesisOutputFormat of Azure
+    azure_format: str
+    openai_format: str
+    # Raw PCM from OpenAI has 24 kHz and is resampled if the format needs another rate
+    sample_rate: int | None = None
+
+
+OPENAI_PCM_SAMPLE_RATE = 24000
+
+OUTPUT_FORMATS: Dict[str, OutputFormat] = {
+    output_format.name: output_format for output_format in (
+        OutputFormat("mp3", "audio/mpeg", lambda _: stitch_mp3, "Audio16Khz32KBitRateMonoMp3", "mp3"),
+        OutputFormat("wav", "audio/wav", lambda _: stitch_wav, "Riff16Khz16BitMonoPcm", "wav"),
+        OutputFormat("pcm_16000", "audio/L16;rate=16000", lambda _: stitch_pcm, "Raw16Khz16BitMonoPcm", "pcm", 16000),
+        OutputFormat("opus", "audio/ogg;codecs=opus", OggStitcher, "Ogg16Khz16BitMonoOpus", "opus"),
+    )
+}
+
+MEDIA_TYPES: Dict[str, str] = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/l16": "pcm_16000",
+    "audio/pcm": "pcm_16000",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+}
+
+
+def negotiate_format(requested: str | None, accept: str | None, default: str) -> OutputFormat | None:
+    """
+    Picks the output format from the format query parameter or else from the Accept header. Returns None if nothing
+    acceptable is supported.
+    """
+    if requested is not None:
+        return OUTPUT_FORMATS.get(requested.lower())
+
+    if not accept:
+        return OUTPUT_FORMATS[default]
+
+    candidates = []
+
+    for position, entry in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0:
+            candidates.append((-quality, position, media_type.lower()))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("*/*", "audio/*"):
+            return OUTPUT_FORMATS[default]
+
+        if media_type in MEDIA_TYPES:
+            return OUTPUT_FORMATS[MEDIA_TYPES[media_type]]
+
+    return None
+
+
+# Input of the recognizers is 16 kHz 16 bit mono PCM
+INPUT_SAMPLE_RATE = 16000
+INPUT_BYTES_PER_SECOND = INPUT_SAMPLE_RATE * 2
+
+
+class AdpcmDecoder:
+    """
+    Decodes a stream of 4 bit IMA/DVI ADPCM without block headers to 16 bit PCM. The predictor state carries over
+    from one frame to the next, so frames can be decoded as they arrive.
+    """
+
+    def __init__(self):
+        self.state = None
+
+    def decode(self, data: bytes) -> bytes:
+        pcm, self.state = audioop.adpcm2lin(data, 2, self.state)
+        return pcm
+
+
+class OggPacketReader:
+    """
+    Splits an Ogg stream into its packets while it arrives. Pages may be cut anywhere, incomplete pages and packets
+    continued on the next page are kept until the rest arrives.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.packet = b""
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self.buffer += data
+        packets = []
+
+        while len(self.buffer) >= 27:
+            if self.buffer[:4] != b"OggS":
+                raise ValueError("Not an Ogg stream")
+
+            header_size = 27 + self.buffer[26]
+
+            if len(self.buffer) < header_size:
+                break
+
+            lacing = self.buffer[27:header_size]
+            page_size = header_size + sum(lacing)
+
+            if len(self.buffer) < page_size:
+                break
+
+            offset = header_size
+
+            # A packet ends with the first segment shorter than 255 bytes
+            for size in lacing:
+                self.packet += self.buffer[offset:offset + size]
+                offset += size
+
+                if size < 255:
+                    packets.append(self.packet)
+                    self.packet = b""
+
+            self.buffer = self.buffer[page_size:]
+
+        return packets
+
+
+class OpusDecoder:
+    """
+    Decodes an Ogg Opus stream to 16 bit mono PCM at the input rate of the recognizers, packet by packet as the pages
+    arrive. libopus resamples and downmixes itself, whatever the stream was encoded with.
+    """
+
+    # The longest Opus packet holds 120 ms
+    MAX_FRAME_SIZE = INPUT_SAMPLE_RATE * 120 // 1000
+
+    def __init__(self):
+        # libopus is only loaded for Opus input, the server runs without it otherwise
+        import opuslib
+
+        self.reader = OggPacketReader()
+        self.decoder = opuslib.Decoder(INPUT_SAMPLE_RATE, 1)
+
+    def decode(self, data: bytes) -> bytes:
+        return b"".join(
+            self.decoder.decode(packet, self.MAX_FRAME_SIZE) for packet in self.reader.feed(data)
+            if not packet.startswith((b"OpusHead", b"OpusTags"))
+        )
+
+
+class DecodeStats:
+    def __init__(self):
+        self.audio_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def record(self, audio_seconds: float, cpu_seconds: float):
+        self.audio_seconds += audio_seconds
+        self.cpu_seconds += cpu_seconds
+
+    def get_metrics(self) -> dict:
+        return dict(
+            audio_seconds=self.audio_seconds,
+            cpu_seconds=self.cpu_seconds,
+            cpu_ms_per_audio_second=self.cpu_seconds / self.audio_seconds * 1000 if self.audio_seconds > 0 else None,
+        )
@@ -4,10 +4,15 @@ from .service.location import LocationService
 from .service.openhab import OpenhabService
 from .service.shopping import ShoppingListService
 from .service.train import TrainService
+from .service.station_index import load_station_index
 from .service.traincheck import TrainCheckService
 from .service.weather import WeatherService
 from .service.skill_manager import SkillManagerService
-from .service.aireport import AiReportService
+from .service.nlu import NluService
+from .service.lanes import PriorityLanes
+from .service.speech import SpeechService
+from .service.speech_pool import RecognizerPool
+from .service.aireport import AiReportService, load_user_profiles
 from .skill.openhab import OpenHABSkill
 from .skill.traincheck import TraincheckSkill
 from .skill.weather import WeatherSkill
@@ -24,11 +29,19 @@ class Container(containers.DeclarativeContainer):
     config = providers.Configuration()
 
     # Services
+    priority_lanes = providers.Singleton(
+        PriorityLanes,
+        config.lanes.high_concurrency,
+        config.lanes.normal_concurrency,
+        config.lanes.low_concurrency,
+    )
+
     calendar_service = providers.Singleton(
         CalendarService,
         config.calendar.url,
         config.calendar.username,
         config.calendar.password,
+        config.calendar.timeout,
     )
 
     openhab_service = providers.Resource(
@@ -42,10 +55,14 @@ class Container(containers.DeclarativeContainer):
         TrainCheckService,
         config.traincheck.station_from,
         config.traincheck.station_via,
+        config.traincheck.cache_ttl,
     )
 
     weather_service = providers.Singleton(
         WeatherService,
+        config.weather.cache_ttl,
+        config.weather.prefetch_top_n,
+        config.weather.request_budget,
     )
 
     location_service = providers.Singleton(
@@ -53,6 +70,7 @@ class Container(containers.DeclarativeContainer):
         config.location.traccar_url,
         config.location.traccar_username,
         config.location.traccar_password,
+        config.location.geofence_cache_ttl,
     )
 
     shoppinglist_service = providers.Singleton(
@@ -60,26 +78,74 @@ class Container(containers.DeclarativeContainer):
         config.shopping.kitchenowl_url,
         config.shopping.kitchenowl_access_token,
         config.shopping.shoppinglist_id,
+        config.shopping.cache_ttl,
+    )
+
+    nlu_service = providers.Singleton(
+        NluService,
+        config.nlu.rasa_base_uri,
+        openhab_service,
+        config.nlu.parse_cache_ttl,
+        config.nlu.parse_cache_size,
+    )
+
+    speech_service = providers.Singleton(
+        SpeechService,
+        config.speech.access_token,
+        config.speech.region,
+        config.speech.language,
+        config.speech.voice,
+        config.speech.tts_parallelism,
+    )
+
+    recognizer_pool = providers.Singleton(
+        RecognizerPool,
+        speech_service,
+        config.speech.pool_size,
+        config.speech.pool_max_age,
+    )
+
+    station_index = providers.Singleton(
+        load_station_index,
+        config.train.station_index_file,
     )
 
     train_service = providers.Singleton(
         TrainService,
         config.train.db_rest_api_url,
+        station_index,
+        config.train.departures_cache_ttl,
     )
 
-    aireport_service = providers.Singleton(
-        AiReportService,
-        config.openai.openai_api_key,
+    report_users = providers.Singleton(
+        load_user_profiles,
+        config.aireport.users_file,
+        config.general.user_name,
         config.location.traccar_device_id,
         config.calendar.calendar_names,
         config.weather.default_place,
-        config.general.user_name,
+        config.traincheck.station_from,
+        config.traincheck.station_via,
+        config.shopping.shoppinglist_id,
+    )
+
+    aireport_service = providers.Singleton(
+        AiReportService,
+        config.openai.openai_api_key,
+        report_users,
+        config.aireport.prompt_token_budget,
+        config.aireport.max_report_age,
+        config.aireport.report_time_bucket,
+        config.aireport.snapshot_path,
+        config.aireport.source_timeout,
+        config.aireport.tts_parallelism,
         location_service,
         calendar_service,
         weather_service,
         traincheck_service,
         shoppinglist_service,
         train_service,
+        priority_lanes,
     )
 
     # Skills
@@ -102,11 +168,14 @@ class Container(containers.DeclarativeContainer):
 
     shopping_skill = providers.Singleton(
         ShoppingSkill,
+        shoppinglist_service,
     )
 
     chatgpt_skill = providers.Singleton(
         ChatGptSkill,
         config.openai.openai_api_key,
+        config.openai.cache_ttl,
+        config.openai.cache_size,
     )
 
     skill_manager = providers.Singleton(
@@ -1,23 +1,35 @@
+import asyncio
+import json
 import logging
 import os
 import time
 from contextlib import asynccontextmanager
-from typing import Annotated
+from datetime import datetime
+from typing import Annotated, List
 
 import aiohttp
 import uvicorn
-import azure.cognitiveservices.speech as speechsdk
-from fastapi import FastAPI, WebSocket, Depends, HTTPException, Header
-from fastapi.responses import Response, StreamingResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Header, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from pydantic import BaseModel
+from .audio import OutputFormat, OUTPUT_FORMATS, negotiate_format
 from .containers import Container
 from dependency_injector.wiring import inject, Provide
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from .service.skill_manager import SkillManagerService
-from .skill.skill import ProcessResponse, map_context
-from .service.aireport import AiReportService
+from .service.openhab import OpenhabService
+from .service.nlu import NluService, fallback_context
+from .service.deadline import deadline, remaining
+from .service.lanes import PriorityLanes, HIGH, NORMAL, LOW
+from .service.speech import SpeechService, INPUT_FORMATS
+from .service.speech_pool import RecognizerPool
+from .skill.chatgpt import ChatGptSkill
+from .skill.openhab import DEVICES_NOT_REACHED
+from .skill.skill import ProcessResponse, ProcessResponseContext
+from .service.aireport import AiReportService, UserReportContext
 
 
 class ProcessPayloadContext(BaseModel):
@@ -29,6 +41,14 @@ class ProcessPayload(BaseModel):
     context: ProcessPayloadContext | None
 
 
+class ProcessBatchPayload(BaseModel):
+    utterances: List[ProcessPayload]
+
+
+class ProcessBatchResponse(BaseModel):
+    results: List[ProcessResponse]
+
+
 class TTSMessage(BaseModel):
     message: str
 
@@ -51,28 +71,66 @@ container.config.calendar.url.from_env("CALENDAR_CALDAV_URL")
 container.config.calendar.username.from_env("CALENDAR_USER")
 container.config.calendar.password.from_env("CALENDAR_PASSWORD")
 container.config.calendar.calendar_names.from_env("CALENDAR_CALENDARS")
+container.config.calendar.timeout.from_env("CALENDAR_TIMEOUT", 10, as_=float)
 container.config.openhab.default_room.from_env('OPENHAB_DEFAULT_ROOM', None)
 container.config.openhab.server_url.from_env('OPENHAB_SERVER_URL', 'http://localhost:8080')
 container.config.openhab.auth_token.from_env('OPENHAB_AUTH_TOKEN', None)
 container.config.openhab.language.from_env('OPENHAB_LANGUAGE', 'de')
 container.config.traincheck.station_from.from_env('TRAINCHECK_STATION_FROM', None)
 container.config.traincheck.station_via.from_env('TRAINCHECK_STATION_VIA', None)
+container.config.traincheck.cache_ttl.from_env('TRAINCHECK_CACHE_TTL', 60, as_=int)
 container.config.weather.default_place.from_env('WEATHER_DEFAULT_PLACE', None)
+container.config.weather.cache_ttl.from_env('WEATHER_CACHE_TTL', 600, as_=int)
+container.config.weather.prefetch_top_n.from_env('WEATHER_PREFETCH_TOP_N', 5, as_=int)
+container.config.weather.request_budget.from_env('WEATHER_REQUEST_BUDGET', 60, as_=int)
 container.config.openai.openai_api_key.from_env('OPENAI_TOKEN', None)
+container.config.openai.cache_ttl.from_env('CHATGPT_CACHE_TTL', 21600, as_=int)
+container.config.openai.cache_size.from_env('CHATGPT_CACHE_SIZE', 256, as_=int)
 container.config.location.traccar_url.from_env('TRACCAR_URL', None)
 container.config.location.traccar_username.from_env('TRACCAR_USERNAME', None)
 container.config.location.traccar_password.from_env('TRACCAR_PASSWORD', None)
 container.config.location.traccar_device_id.from_env('TRACCAR_DEVICE_ID', None)
+container.config.location.geofence_cache_ttl.from_env('TRACCAR_GEOFENCE_CACHE_TTL', 3600, as_=int)
 container.config.shopping.kitchenowl_url.from_env('KITCHENOWL_URL', None)
 container.config.shopping.kitchenowl_access_token.from_env('KITCHENOWL_TOKEN', None)
 container.config.shopping.shoppinglist_id.from_env('SHOPPINGLIST_ID', None)
+container.config.shopping.cache_ttl.from_env('SHOPPINGLIST_CACHE_TTL', 300, as_=int)
+container.config.nlu.rasa_base_uri.from_env('RASA_BASE_URI', 'http://localhost:5005')
+container.config.nlu.parse_cache_ttl.from_env('NLU_PARSE_CACHE_TTL', 3600, as_=int)
+container.config.nlu.parse_cache_size.from_env('NLU_PARSE_CACHE_SIZE', 512, as_=int)
+container.config.lanes.high_concurrency.from_env('LANE_HIGH_CONCURRENCY', 16, as_=int)
+container.config.lanes.normal_concurrency.from_env('LANE_NORMAL_CONCURRENCY', 4, as_=int)
+container.config.lanes.low_concurrency.from_env('LANE_LOW_CONCURRENCY', 2, as_=int)
+container.config.speech.access_token.from_env('AZURE_SPEECH_ACCESS_TOKEN', None)
+container.config.speech.region.from_env('AZURE_SPEECH_REGION', None)
+container.config.speech.language.from_env('AZURE_SPEECH_LANGUAGE', 'de-DE')
+container.config.speech.voice.from_env('AZURE_SPEECH_VOICE', 'de-DE-AmalaNeural')
+container.config.speech.tts_parallelism.from_env('AZURE_TTS_PARALLELISM', 4, as_=int)
+container.config.speech.pool_size.from_env('AZURE_STT_POOL_SIZE', 2, as_=int)
+container.config.speech.pool_max_age.from_env('AZURE_STT_POOL_MAX_AGE', 120, as_=int)
 container.config.general.user_name.from_env('USER_NAME', None)
 container.config.train.db_rest_api_url.from_env('DB_REST_API_URL', 'https://v6.db.transport.rest')
-
-RASA_BASE_URI = os.environ.get('RASA_BASE_URI', 'http://localhost:5005')
-AZURE_SPEECH_ACCESS_TOKEN = os.environ.get('AZURE_SPEECH_ACCESS_TOKEN', None)
-AZURE_SPEECH_REGION = os.environ.get('AZURE_SPEECH_REGION', None)
-AZURE_SPEECH_LANGUAGE = os.environ.get('AZURE_SPEECH_LANGUAGE', 'de-DE')
+container.config.train.station_index_file.from_env('TRAIN_STATION_INDEX_FILE', None)
+container.config.train.departures_cache_ttl.from_env('TRAIN_DEPARTURES_CACHE_TTL', 30, as_=int)
+container.config.aireport.prompt_token_budget.from_env('AIREPORT_PROMPT_TOKEN_BUDGET', 1500, as_=int)
+container.config.aireport.max_report_age.from_env('AIREPORT_MAX_REPORT_AGE', 900, as_=int)
+container.config.aireport.report_time_bucket.from_env('AIREPORT_REPORT_TIME_BUCKET', 900, as_=int)
+container.config.aireport.snapshot_path.from_env('AIREPORT_SNAPSHOT_PATH', None)
+container.config.aireport.users_file.from_env('AIREPORT_USERS_FILE', None)
+container.config.aireport.source_timeout.from_env('AIREPORT_SOURCE_TIMEOUT', 10, as_=float)
+container.config.aireport.tts_parallelism.from_env('AIREPORT_TTS_PARALLELISM', 4, as_=int)
+
+# Budget of the intent recognition and of device control, a voice command is answered within it even if an upstream
+# hangs. Everything else runs in the normal lane, where the ChatGPT fallback alone may take tens of seconds.
+PROCESS_DEADLINE = float(os.environ.get('PROCESS_DEADLINE', 4.0))
+NORMAL_LANE_DEADLINE = float(os.environ.get('NORMAL_LANE_DEADLINE', 60.0))
+
+LANE_DEADLINES = {
+    HIGH: PROCESS_DEADLINE,
+    NORMAL: NORMAL_LANE_DEADLINE,
+}
+
+DEADLINE_EXCEEDED_RESPONSE = "Das hat leider zu lange gedauert."
 
 api_token = os.environ.get('API_TOKEN', None)
 
@@ -85,109 +143,355 @@ def verify_token(authorization: Annotated[str | None, Header()] = None):
         )
 app = FastAPI(dependencies=[Depends(verify_token)])
 
+def get_lane(context: ProcessResponseContext) -> str:
+    # Device control must not queue up behind LLM calls
+    return HIGH if context.nlu.intent.name.startswith("smarthome_") else NORMAL
+
+async def run_skills_in_lane(lanes: PriorityLanes, skill_manager: SkillManagerService, context: ProcessResponseContext):
+    """
+    Runs the skills within the budget of their lane, including the wait for admission. Has to be called outside the
+    deadline of the parsing, a deadline is never extended.
+    """
+    lane = get_lane(context)
+
+    with deadline(LANE_DEADLINES[lane]):
+        async def run():
+            async with lanes.admit(lane):
+                return await skill_manager.run_skills(context)
+
+        return await asyncio.wait_for(run(), remaining())
+
+async def process_utterance(
+        utterance: str,
+        site: str | None,
+        nlu: NluService,
+        skill_manager: SkillManagerService,
+        lanes: PriorityLanes,
+) -> ProcessResponse:
+    try:
+        with deadline(PROCESS_DEADLINE):
+            context = await asyncio.wait_for(nlu.parse(utterance, site), remaining())
+    except TimeoutError:
+        logger.warning(f"Parsing '{utterance}' exceeded the deadline of {PROCESS_DEADLINE}s")
+        return ProcessResponse(response=DEADLINE_EXCEEDED_RESPONSE, context=fallback_context(utterance, site))
+
+    try:
+        skill_result = await run_skills_in_lane(lanes, skill_manager, context)
+    except TimeoutError:
+        lane = get_lane(context)
+        logger.warning(f"Processing '{utterance}' exceeded the deadline of the {lane} lane of {LANE_DEADLINES[lane]}s")
+        return ProcessResponse(response=DEADLINE_EXCEEDED_RESPONSE, context=context)
+
+    if skill_result is not None:
+        return ProcessResponse(response=skill_result.response, context=context)
+    else:
+        return ProcessResponse(response="", context=context)
+
 @app.post("/assistant/process")
 @inject
-async def process(payload: ProcessPayload, skill_manager: SkillManagerService = Depends(Provide[Container.skill_manager])) -> ProcessResponse:
-    async with aiohttp.ClientSession() as session:
-        result = await session.post(f'{RASA_BASE_URI}/model/parse', json=dict(text=payload.utterance))
-        result_json = await result.json()
-        context = map_context(
-            result_json,
-            payload.utterance,
-            payload.context.room if payload.context is not None else None
+async def process(
+        payload: ProcessPayload,
+        skill_manager: SkillManagerService = Depends(Provide[Container.skill_manager]),
+        nlu: NluService = Depends(Provide[Container.nlu_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+) -> ProcessResponse:
+    site = payload.context.room if payload.context is not None else None
+    return await process_utterance(payload.utterance, site, nlu, skill_manager, lanes)
+
+@app.post("/assistant/process/batch")
+@inject
+async def process_batch(
+        payload: ProcessBatchPayload,
+        skill_manager: SkillManagerService = Depends(Provide[Container.skill_manager]),
+        nlu: NluService = Depends(Provide[Container.nlu_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+        openhab: OpenhabService = Depends(Provide[Container.openhab_service]),
+) -> ProcessBatchResponse:
+    utterances = [
+        (item.utterance, item.context.room if item.context is not None else None) for item in payload.utterances
+    ]
+
+    try:
+        with deadline(PROCESS_DEADLINE):
+            contexts = await asyncio.wait_for(nlu.parse_batch(utterances), remaining())
+    except TimeoutError:
+        logger.warning(f"Parsing a batch of {len(utterances)} utterances exceeded the deadline of {PROCESS_DEADLINE}s")
+        return ProcessBatchResponse(results=[
+            ProcessResponse(response=DEADLINE_EXCEEDED_RESPONSE, context=fallback_context(utterance, site))
+            for utterance, site in utterances
+        ])
+
+    async def run(context: ProcessResponseContext):
+        # Every utterance collects its own device commands, so they can be merged in the order of the utterances
+        with openhab.collect_commands() as commands:
+            try:
+                skill_result = await run_skills_in_lane(lanes, skill_manager, context)
+            except TimeoutError:
+                return DEADLINE_EXCEEDED_RESPONSE, []
+
+        return skill_result.response if skill_result is not None else "", commands
+
+    outcomes = await asyncio.gather(*(run(context) for context in contexts))
+
+    # All commands are kept, the commands of one device are sent in the order of the utterances
+    merged_commands = [command for _, commands in outcomes for command in commands]
+    # Index of the utterance every command belongs to
+    owners = [idx for idx, (_, commands) in enumerate(outcomes) for _ in commands]
+    failed = set()
+
+    with deadline(PROCESS_DEADLINE):
+        if len(merged_commands) > 0:
+            try:
+                errors = await asyncio.wait_for(openhab.dispatch_commands(merged_commands), remaining())
+                failed = {owner for owner, error in zip(owners, errors) if error is not None}
+            except TimeoutError:
+                logger.warning(f"Sending {len(merged_commands)} openHAB commands exceeded the deadline")
+                failed = set(owners)
+
+    # The skills answered before the commands were sent, utterances whose commands failed must not claim success
+    return ProcessBatchResponse(results=[
+        ProcessResponse(response=DEVICES_NOT_REACHED if idx in failed else response, context=context)
+        for idx, ((response, _), context) in enumerate(zip(outcomes, contexts))
+    ])
+
+@app.get("/assistant/metrics")
+@inject
+async def metrics(
+        nlu: NluService = Depends(Provide[Container.nlu_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+        skill_manager: SkillManagerService = Depends(Provide[Container.skill_manager]),
+        speech: SpeechService = Depends(Provide[Container.speech_service]),
+        recognizer_pool: RecognizerPool = Depends(Provide[Container.recognizer_pool]),
+        chatgpt: ChatGptSkill = Depends(Provide[Container.chatgpt_skill]),
+) -> dict:
+    return dict(
+        nlu=nlu.get_metrics(),
+        lanes=lanes.get_metrics(),
+        skill_results=skill_manager.get_metrics(),
+        speech=speech.get_metrics(),
+        recognizer_pool=recognizer_pool.get_metrics(),
+        chatgpt=chatgpt.get_metrics(),
+    )
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match lists tags or is *, and is compared weakly, i.e. ignoring the W/ prefix (RFC 9110, 13.1.2)
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return opaque(etag) in (opaque(tag) for tag in if_none_match.split(","))
+
+def get_output_format(requested: str | None, accept: str | None, default: str) -> OutputFormat:
+    output_format = negotiate_format(requested, accept, default)
+
+    if output_format is None:
+        raise HTTPException(
+            status_code=400 if requested is not None else 406,
+            detail=f"Supported audio formats are {', '.join(OUTPUT_FORMATS)}",
         )
-        skill_result = await skill_manager.run_skills(context)
 
-        if skill_result is not None:
-            return ProcessResponse(response=skill_result.response, context=context)
-        else:
-            return ProcessResponse(response="", context=context)
+    return output_format
+
+def get_report_user(aireport: AiReportService, user: str | None) -> UserReportContext:
+    user_context = aireport.get_user(user)
+
+    if user_context is None:
+        raise HTTPException(status_code=404, detail=f"Unknown user {user}")
+
+    return user_context
 
 @app.get("/assistant/report/text")
 @inject
-async def generate_text_report(aireport: AiReportService = Depends(Provide[Container.aireport_service])) -> ReportResponse:
-    report = await aireport.generate_text_report()
+async def generate_text_report(
+        user: str | None = None,
+        aireport: AiReportService = Depends(Provide[Container.aireport_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+) -> ReportResponse:
+    user_context = get_report_user(aireport, user)
+
+    async with lanes.admit(NORMAL):
+        report = await aireport.generate_text_report(user_context)
+
     return ReportResponse(report=report)
 
 @app.get("/assistant/report/speach")
 @inject
-async def generate_voice_report(aireport: AiReportService = Depends(Provide[Container.aireport_service])) -> StreamingResponse:
-    return StreamingResponse(aireport.generate_voice_report(), media_type="audio/mpeg")
+async def generate_voice_report(
+        user: str | None = None,
+        audio_format: Annotated[str | None, Query(alias="format")] = None,
+        accept: Annotated[str | None, Header()] = None,
+        aireport: AiReportService = Depends(Provide[Container.aireport_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+) -> StreamingResponse:
+    """
+    Streams the spoken report in the format of the format query parameter or the Accept header: mp3, wav, pcm_16000 or opus.
+    Long texts are synthesized in chunks. Opus chunks are joined into one Ogg stream, but every chunk after the first
+    starts with a few milliseconds of encoder warm-up.
+    """
+    user_context = get_report_user(aireport, user)
+    output_format = get_output_format(audio_format, accept, "mp3")
+
+    async def stream():
+        async with lanes.admit(NORMAL):
+            async for chunk in aireport.generate_voice_report(user_context, output_format):
+                yield chunk
+
+    return StreamingResponse(stream(), media_type=output_format.media_type)
 
 @app.get("/assistant/report/structured")
 @inject
-async def generate_voice_report(
+async def generate_structured_report(
         location: str,
-        aireport: AiReportService = Depends(Provide[Container.aireport_service])
-) -> StreamingResponse:
+        user: str | None = None,
+        if_none_match: Annotated[str | None, Header()] = None,
+        aireport: AiReportService = Depends(Provide[Container.aireport_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+) -> Response:
     parsed_location = None
 
     if location is not None:
         location_split = location.split(',')
         parsed_location = float(location_split[0]), float(location_split[1])
 
-    return await aireport.generate_structured_report(parsed_location)
+    user_context = get_report_user(aireport, user)
+
+    async with lanes.admit(NORMAL):
+        report = await aireport.generate_structured_report(user_context, parsed_location)
+
+    if report is None:
+        return JSONResponse(content=None)
+
+    etag = f'"{aireport.get_structured_report_etag(report)}"'
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return JSONResponse(content=jsonable_encoder(report), headers={"ETag": etag})
 
 @app.post("/assistant/azure-tts")
-async def azure_tts(message: TTSMessage):
-    speech_config = speechsdk.SpeechConfig(
-        subscription=AZURE_SPEECH_ACCESS_TOKEN,
-        region=AZURE_SPEECH_REGION
+@inject
+async def azure_tts(
+        message: TTSMessage,
+        audio_format: Annotated[str | None, Query(alias="format")] = None,
+        accept: Annotated[str | None, Header()] = None,
+        speech: SpeechService = Depends(Provide[Container.speech_service]),
+):
+    """
+    Streams the spoken message in the format of the format query parameter or the Accept header: mp3, wav, pcm_16000 or opus.
+    Long texts are synthesized in chunks. Opus chunks are joined into one Ogg stream, but every chunk after the first
+    starts with a few milliseconds of encoder warm-up.
+    """
+    output_format = get_output_format(audio_format, accept, "wav")
+    return StreamingResponse(
+        speech.synthesize_chunked(message.message, output_format),
+        media_type=output_format.media_type,
     )
-    speech_config.speech_synthesis_voice_name = "de-DE-AmalaNeural"
-    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config)
 
-    text = message.message
-    ssml_text = f"<speak version='1.0' xml:lang='de-DE'><voice name='de-DE-AmalaNeural'><prosody rate='20%'>{text}</prosody></voice></speak>"
 
-    result = speech_synthesizer.speak_ssml_async(ssml_text).get()
-    audio_data = result.audio_data
-    return Response(
-        content=audio_data,
-        status_code=200
-    )
+@app.websocket("/assistant/conversation")
+@inject
+async def conversation(
+        websocket: WebSocket,
+        room: str | None = None,
+        audio_format: Annotated[str, Query(alias="format")] = "pcm_16000",
+        input_format: str = "pcm",
+        speech: SpeechService = Depends(Provide[Container.speech_service]),
+        recognizer_pool: RecognizerPool = Depends(Provide[Container.recognizer_pool]),
+        skill_manager: SkillManagerService = Depends(Provide[Container.skill_manager]),
+        nlu: NluService = Depends(Provide[Container.nlu_service]),
+        lanes: PriorityLanes = Depends(Provide[Container.priority_lanes]),
+):
+    """
+    One connection for a whole conversation. The client streams audio as binary messages and sends {"type": "stop"}
+    to end the session. For every recognized phrase the server sends a transcript and a response message, followed
+    by the spoken response as binary messages between audio_start and audio_end. The format of the spoken response
+    can be picked with the format query parameter, the format of the streamed audio with the input_format query
+    parameter: 16 kHz 16 bit mono pcm, adpcm (IMA ADPCM of the same) or opus (an Ogg Opus stream).
+    """
+    output_format = OUTPUT_FORMATS.get(audio_format)
+
+    if output_format is None:
+        await websocket.close(code=1003, reason=f"Unsupported format {audio_format}")
+        return
+
+    if input_format not in INPUT_FORMATS:
+        await websocket.close(code=1003, reason=f"Unsupported input format {input_format}")
+        return
 
+    await websocket.accept()
 
-@app.websocket("/assistant/azure-stt")
-async def azure_stt(websocket: WebSocket):
-    speech_config = speechsdk.SpeechConfig(
-        subscription=AZURE_SPEECH_ACCESS_TOKEN,
-        region=AZURE_SPEECH_REGION
-    )
-    speech_config.speech_recognition_language = AZURE_SPEECH_LANGUAGE
+    # Recognizer and synthesizer are created once and stay warm for all turns of the conversation
+    session = await recognizer_pool.acquire(input_format)
+    synthesizer = speech.create_synthesizer(output_format)
+    await session.start()
 
-    # Setup the audio stream
-    stream = speechsdk.audio.PushAudioInputStream()
-    audio_config = speechsdk.audio.AudioConfig(stream=stream)
+    async def respond():
+        while (utterance := await session.phrases.get()) is not None:
+            await websocket.send_json(dict(type="transcript", text=utterance))
+            response = await process_utterance(utterance, room, nlu, skill_manager, lanes)
+            await websocket.send_json(dict(type="response", **jsonable_encoder(response)))
 
-    # Instantiate the speech recognizer with push stream input
-    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+            if response.response:
+                await websocket.send_json(dict(type="audio_start", format=output_format.name))
 
-    result: str | None = None
-    stopped = False
+                async for chunk in speech.stream_synthesis(response.response, synthesizer):
+                    await websocket.send_bytes(chunk)
 
-    def recognized_cb(evt):
-        nonlocal result
-        result = evt.result.text
+                await websocket.send_json(dict(type="audio_end"))
 
-    def session_stopped_cb(evt):
-        nonlocal stopped
-        logger.info('Azure SESSION STOPPED: {}'.format(evt))
-        stopped = True
+    responder = asyncio.create_task(respond())
+
+    try:
+        while not responder.done():
+            message = await websocket.receive()
 
-    # Connect callbacks to the events fired by the speech recognizer
-    speech_recognizer.recognizing.connect(lambda evt: logger.info(f'Azure RECOGNIZING: {evt}'))
-    speech_recognizer.recognized.connect(recognized_cb)
-    speech_recognizer.session_started.connect(lambda evt: logger.info(f'Azure SESSION STARTED: {evt}'))
-    speech_recognizer.session_stopped.connect(session_stopped_cb)
-    speech_recognizer.canceled.connect(lambda evt: logger.error(f'Azure CANCELED {evt}'))
+            if message['type'] == 'websocket.disconnect':
+                break
+            elif message.get('bytes') is not None:
+                session.write(message['bytes'])
+            elif message.get('text') is not None and json.loads(message['text']).get('type') == 'stop':
+                break
+    finally:
+        await session.stop()
 
-    speech_recognizer.recognize_once_async()
+    # Finish the turn that is currently answered before closing
+    try:
+        await asyncio.wait_for(responder, PROCESS_DEADLINE)
+    except (TimeoutError, WebSocketDisconnect):
+        responder.cancel()
+
+    if responder.done() and not responder.cancelled() and responder.exception() is not None:
+        logger.error(f"Conversation failed: {responder.exception()!r}")
+
+
+@app.websocket("/assistant/azure-stt")
+@inject
+async def azure_stt(
+        websocket: WebSocket,
+        input_format: str = "pcm",
+        recognizer_pool: RecognizerPool = Depends(Provide[Container.recognizer_pool]),
+):
+    if input_format not in INPUT_FORMATS:
+        await websocket.close(code=1003, reason=f"Unsupported input format {input_format}")
+        return
+
+    # A pooled session is already connected, compressed input is decoded frame by frame while it arrives
+    session = await recognizer_pool.acquire(input_format)
+    await session.start()
 
     await websocket.accept()
 
-    while not stopped:
-        try:
+    # The first recognized phrase is the result, the session ends without one if it is canceled
+    phrase = asyncio.ensure_future(session.phrases.get())
+
+    try:
+        while not phrase.done():
             message = await websocket.receive()
 
             if 'text' in message:
@@ -195,28 +499,77 @@ async def azure_stt(websocket: WebSocket):
             else:
                 data = message['bytes']
 
-            stream.write(data)
-        except Exception as ex:
-            logger.error(f"Failure during incoming websocket processing: {ex}")
-            return
+            session.write(data)
+    except Exception as ex:
+        logger.error(f"Failure during incoming websocket processing: {ex}")
+        phrase.cancel()
+        return
+    finally:
+        await session.stop()
 
-    await websocket.send_text(result)
+    await websocket.send_text(phrase.result() or "")
 
 aireport = Provide[Container.aireport_service]
+weather = Provide[Container.weather_service]
+location = Provide[Container.location_service]
+lanes = Provide[Container.priority_lanes]
+recognizer_pool = Provide[Container.recognizer_pool]
 
+# Background refreshes run in the low lane, so they never delay interactive requests
 async def aireport_updater():
-    await aireport.update_context()
+    async with lanes.admit(LOW):
+        await aireport.update_context()
+        await aireport.precompute_reports()
+
+async def weather_prefetcher():
+    async with lanes.admit(LOW):
+        await weather.prefetch_popular_places()
+
+async def nlu_model_checker():
+    nlu = await container.nlu_service()
+
+    try:
+        async with lanes.admit(LOW):
+            await nlu.check_model()
+    except aiohttp.ClientError as e:
+        logger.warning(f"Could not check the Rasa model: {e!r}")
+
+# Replaces pooled recognizers that aged or lost their connection while nobody asked for one
+async def recognizer_pool_refresher():
+    async with lanes.admit(LOW):
+        top_up = recognizer_pool.schedule_top_up()
+
+        if top_up is not None:
+            await top_up
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     scheduler = AsyncIOScheduler()
-    await aireport_updater()
+    # Serve reports from the persisted context right away and refresh it in the background
+    aireport.load_context_snapshot()
 
     scheduler.start()
-    scheduler.add_job(aireport_updater, IntervalTrigger(minutes=1))
+    scheduler.add_job(aireport_updater, IntervalTrigger(minutes=1), next_run_time=datetime.now())
+    scheduler.add_job(weather_prefetcher, IntervalTrigger(minutes=1))
+    scheduler.add_job(nlu_model_checker, IntervalTrigger(minutes=1), next_run_time=datetime.now())
+
+    if container.config.speech.access_token() is not None:
+        scheduler.add_job(recognizer_pool_refresher, IntervalTrigger(seconds=30), next_run_time=datetime.now())
+
+    location_listener = None
+
+    if container.config.location.traccar_url() is not None:
+        location_listener = asyncio.create_task(location.listen())
+
     yield
     scheduler.shutdown()
 
+    if location_listener is not None:
+        location_listener.cancel()
+
+    await location.close()
+    await recognizer_pool.close()
+
 app.router.lifespan_context = lifespan
 
 container.wire(modules=[__name__])
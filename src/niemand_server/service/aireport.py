@@ -1,16 +1,26 @@
+import asyncio
+import hashlib
+import json
 import logging
-from dataclasses import dataclass
+import os
+import pickle
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from functools import reduce
-from typing import List
+from typing import AsyncIterator, List, Dict, Tuple
 
 from openai import OpenAI
 
+from niemand_server.audio import split_text, synthesize_chunked, convert_stream, OutputFormat, PcmResampler, \
+    OUTPUT_FORMATS, OPENAI_PCM_SAMPLE_RATE
 from niemand_server.service.calendar import CalendarEntry, TodoEntry, CalendarService
+from niemand_server.service.lanes import PriorityLanes, LOW
 from niemand_server.service.location import LocationService, DeviceLocation
+from niemand_server.service.prompt import PromptBuilder, PromptSection, Prompt
+from niemand_server.service.resilience import ResilientSource, SourceValue
 from niemand_server.service.shopping import ShoppinglistItem, ShoppingListService
 from niemand_server.service.train import TrainService, Station, Trip
-from niemand_server.service.traincheck import TrainCheckService
+from niemand_server.service.traincheck import TrainCheckService, DepartureBoard, Departure
 from niemand_server.service.weather import WeatherService
 
 
@@ -26,7 +36,7 @@ class Weather:
 
 @dataclass
 class TrainData:
-    train_status: str
+    departures: DepartureBoard
     last_updated: datetime
 
 @dataclass
@@ -41,92 +51,346 @@ class ContextData:
     train_status: TrainData | None
     shoppinglist: ShoppingList | None
 
+# Identifies an upstream fetch, e.g. ("weather", "berlin"). Users with the same source key share one fetch.
+SourceKey = Tuple[str, ...]
+
+@dataclass
+class ContextSnapshot:
+    saved_at: datetime
+    sources: Dict[SourceKey, SourceValue]
+    # Snapshots written with another version hold incompatible context types and are ignored
+    version: int = 1
+
+SNAPSHOT_VERSION = 2
+
+@dataclass
+class CachedReport:
+    digest: str
+    time_bucket: int
+    text: str
+    generated_at: datetime
+    prompt_tokens: int
+    # Synthesized report by output format name
+    audio: Dict[str, bytes] = field(default_factory=dict)
+
+    def age(self) -> timedelta:
+        return datetime.now() - self.generated_at
+
+@dataclass
+class UserProfile:
+    name: str
+    traccar_device_id: str | None
+    calendar_names: List[str]
+    weather_place: str | None
+    train_station_from: str | None
+    train_station_via: str | None
+    shoppinglist_id: str | None
+
+class UserReportContext:
+    def __init__(self, profile: UserProfile):
+        self.profile = profile
+        self.context_data = ContextData(
+            location=None,
+            calender=None,
+            weather=None,
+            train_status=None,
+            shoppinglist=None,
+        )
+
+        # Keyed by the ContextData field the sources fill
+        self.source_keys: Dict[str, List[SourceKey]] = {
+            "location": [("location", profile.traccar_device_id)] if profile.traccar_device_id else [],
+            "calender": [("calendar", name) for name in profile.calendar_names],
+            "weather": [("weather", profile.weather_place)] if profile.weather_place else [],
+            "train_status": [("train", profile.train_station_from, profile.train_station_via)] if profile.train_station_from else [],
+            "shoppinglist": [("shoppinglist", profile.shoppinglist_id)] if profile.shoppinglist_id else [],
+        }
+
+        self.reports: Dict[Tuple[str, int], CachedReport] = {}
+        self.latest_report: CachedReport | None = None
+        self.report_lock = asyncio.Lock()
+
+def load_user_profiles(
+        users_file: str | None,
+        user_name: str | None,
+        traccar_device_id: str | None,
+        calendar_names: str | None,
+        weather_place: str | None,
+        train_station_from: str | None,
+        train_station_via: str | None,
+        shoppinglist_id: str | None,
+) -> List[UserProfile]:
+    default = UserProfile(
+        name=user_name,
+        traccar_device_id=traccar_device_id,
+        calendar_names=calendar_names.split(',') if calendar_names else [],
+        weather_place=weather_place,
+        train_station_from=train_station_from,
+        train_station_via=train_station_via,
+        shoppinglist_id=shoppinglist_id,
+    )
+
+    if users_file is None:
+        return [default]
+
+    with open(users_file, "rt", encoding="utf-8") as f:
+        users = json.load(f)
+
+    # Every setting that is not given for a user falls back to the global configuration
+    return [
+        UserProfile(
+            name=user['name'],
+            traccar_device_id=user.get('traccar_device_id', default.traccar_device_id),
+            calendar_names=user.get('calendars', default.calendar_names),
+            weather_place=user.get('weather_place', default.weather_place),
+            train_station_from=user.get('train_station_from', default.train_station_from),
+            train_station_via=user.get('train_station_via', default.train_station_via),
+            shoppinglist_id=user.get('shoppinglist_id', default.shoppinglist_id),
+        ) for user in users
+    ]
+
 @dataclass
 class StructuredReport:
     train_stations: List[Station]
     trains: List[Trip]
     shopping_list: List[ShoppinglistItem]
+    train_check: List[Departure] | None
 
 class AiReportService:
+    # Long reports are synthesized in chunks of whole sentences, in parallel
+    TTS_CHUNK_CHARS = 400
+    # Format of the precomputed audio
+    DEFAULT_AUDIO_FORMAT = "mp3"
+    # The next calendar entries are kept while the prompt can be shortened elsewhere
+    CALENDAR_MIN_ENTRIES = 5
+
     def __init__(
             self,
             openai_api_key: str,
-            traccar_device_id: str,
-            calendar_names: str,
-            default_place: str,
-            user_name: str,
+            users: List[UserProfile],
+            prompt_token_budget: int,
+            max_report_age: int,
+            report_time_bucket: int,
+            snapshot_path: str | None,
+            source_timeout: float,
+            tts_parallelism: int,
             location_service: LocationService,
             calendar_service: CalendarService,
             weather_service: WeatherService,
             traincheck_service: TrainCheckService,
             shopping_list_service: ShoppingListService,
             train_service: TrainService,
+            lanes: PriorityLanes,
     ):
         self.client = OpenAI(api_key=openai_api_key)
-        self.traccar_device_id = traccar_device_id
-        self.default_place = default_place
-        self.calendar_names = calendar_names.split(',')
-        self.user_name = user_name
+        self.prompt_token_budget = prompt_token_budget
+        self.max_report_age = timedelta(seconds=max_report_age)
+        self.report_time_bucket = report_time_bucket
+        self.snapshot_path = snapshot_path
+        self.source_timeout = source_timeout
+        self.tts_parallelism = tts_parallelism
         self.location_service = location_service
         self.calendar_service = calendar_service
         self.weather_service = weather_service
         self.traincheck_service = traincheck_service
         self.shopping_list_service = shopping_list_service
         self.train_service = train_service
+        self.lanes = lanes
         self.logger = logging.getLogger(__name__)
 
-        self.context_data = ContextData(
-            location=None,
-            calender=None,
-            weather=None,
-            train_status=None,
-            shoppinglist=None,
+        self.users: Dict[str, UserReportContext] = {profile.name: UserReportContext(profile) for profile in users}
+        self.context_updated_at: datetime | None = None
+
+        # Sources are shared between all users with the same source key, so every upstream is fetched only once
+        self.sources: Dict[SourceKey, ResilientSource] = {}
+
+        for user in self.users.values():
+            for keys in user.source_keys.values():
+                for key in keys:
+                    if key not in self.sources:
+                        self.sources[key] = self.create_source(key)
+
+        self.precompute_task: asyncio.Task | None = None
+        self.location_service.add_listener(self.on_location_update)
+
+    def create_source(self, key: SourceKey) -> ResilientSource:
+        kind, *args = key
+        name = "/".join(str(part) for part in key)
+
+        if kind == "location":
+            return ResilientSource(name, lambda: self.fetch_location(*args), self.source_timeout)
+        elif kind == "calendar":
+            return ResilientSource(name, lambda: self.fetch_calendar(*args), self.source_timeout)
+        elif kind == "weather":
+            return ResilientSource(name, lambda: self.fetch_weather(*args), self.source_timeout, timedelta(minutes=15))
+        elif kind == "train":
+            return ResilientSource(name, lambda: self.fetch_train_status(*args), self.source_timeout, timedelta(minutes=5))
+        elif kind == "shoppinglist":
+            return ResilientSource(name, lambda: self.fetch_shoppinglist(*args), self.source_timeout)
+        else:
+            raise ValueError(f"Unknown context source {kind}")
+
+    def get_user(self, user_name: str | None) -> UserReportContext | None:
+        if user_name is None:
+            return next(iter(self.users.values()))
+
+        return self.users.get(user_name)
+
+    async def fetch_location(self, device_id: str) -> DeviceLocation | None:
+        return await self.location_service.get_device_location(device_id)
+
+    async def fetch_calendar(self, calendar_name: str) -> Calendar:
+        entries, todos = await asyncio.to_thread(
+            self.calendar_service.get_upcoming_events_and_todos, [calendar_name], 7
+        )
+        return Calendar(entries=entries, todos=todos)
+
+    async def fetch_weather(self, place: str) -> Weather | None:
+        forecast = await self.weather_service.get_forecast(place)
+        return Weather(forecast=forecast, last_updated=datetime.now()) if forecast is not None else None
+
+    async def fetch_train_status(self, station_from: str, station_via: str | None) -> TrainData:
+        return TrainData(
+            departures=await self.traincheck_service.get_departures(station_from, station_via),
+            last_updated=datetime.now(),
         )
 
+    async def fetch_shoppinglist(self, shoppinglist_id: str) -> ShoppingList:
+        return ShoppingList(shopping_list=await self.shopping_list_service.get_shoppinglist_items(shoppinglist_id))
+
     async def update_context(self):
-        self.logger.info(f"Start updating user context")
-        self.logger.info(f"Updating location context")
-        self.context_data.location = await self.location_service.get_device_location(self.traccar_device_id)
-
-        self.logger.info(f"Updating calendar context")
-        entries, todos = self.calendar_service.get_upcoming_events_and_todos(self.calendar_names, 7)
-        self.context_data.calender = Calendar(entries=entries, todos=todos)
-
-        if self.context_data.weather is None or self.context_data.weather.last_updated < datetime.now() - timedelta(minutes=15):
-            self.logger.info("Updating weather context")
-            self.context_data.weather = Weather(
-                forecast=await self.weather_service.get_forecast(self.default_place),
-                last_updated=datetime.now(),
-            )
+        self.logger.info(f"Start updating context of {len(self.users)} users from {len(self.sources)} sources")
+
+        # Every source is bounded by its own timeout, so a failing upstream cannot hold up the whole refresh
+        values = await asyncio.gather(*(source.get() for source in self.sources.values()))
 
-        if self.context_data.train_status is None or self.context_data.train_status.last_updated < datetime.now() - timedelta(minutes=5):
-            self.logger.info("Updating train context")
-            self.context_data.train_status = TrainData(
-                train_status=await self.traincheck_service.check_train(),
-                last_updated=datetime.now(),
+        stale_sources = [source.name for source, value in zip(self.sources.values(), values) if value is None or value.stale]
+
+        if len(stale_sources) > 0:
+            self.logger.warning(f"Serving stale or missing data for {stale_sources}")
+
+        self.assemble_user_contexts()
+        self.context_updated_at = datetime.now()
+        self.save_context_snapshot()
+
+        self.logger.info(f"Finished updating user context")
+
+    def assemble_user_contexts(self):
+        for user in self.users.values():
+            values = {
+                name: [self.sources[key].last.value for key in keys if self.sources[key].last is not None]
+                for name, keys in user.source_keys.items()
+            }
+
+            calendars = values.pop("calender")
+            calendar = Calendar(
+                entries=[entry for calendar in calendars for entry in calendar.entries],
+                todos=[todo for calendar in calendars for todo in calendar.todos],
+            ) if len(calendars) > 0 else None
+
+            # The remaining fields are filled by at most one source, whose value is shared with the other users
+            user.context_data = ContextData(
+                calender=calendar,
+                **{name: field_values[0] if len(field_values) > 0 else None for name, field_values in values.items()}
             )
 
-        self.logger.info("Updating shoppinglist context")
-        self.context_data.shoppinglist = ShoppingList(
-            shopping_list=await self.shopping_list_service.get_shoppinglist_items()
+    async def on_location_update(self, device_id: str, location: DeviceLocation, previous: DeviceLocation | None):
+        source = self.sources.get(("location", device_id))
+
+        if source is None:
+            return
+
+        source.last = SourceValue(value=location, updated_at=datetime.now())
+        self.assemble_user_contexts()
+
+        # Only the geofence category changes what goes into a report
+        if previous is not None and previous.geofence_category == location.geofence_category:
+            return
+
+        self.logger.info(f"Device {device_id} entered geofence category {location.geofence_category}")
+
+        if self.precompute_task is None or self.precompute_task.done():
+            self.precompute_task = asyncio.create_task(self.precompute_reports_in_background())
+
+    def get_age_marker(self, user: UserReportContext, field_name: str) -> str | None:
+        stale = [
+            self.sources[key].last for key in user.source_keys[field_name]
+            if self.sources[key].last is not None and self.sources[key].last.stale
+        ]
+
+        if len(stale) == 0:
+            return None
+
+        oldest = min(value.updated_at for value in stale)
+        return f"Stand {oldest.astimezone().strftime('%H:%M')}"
+
+    def get_context_age(self) -> timedelta | None:
+        if self.context_updated_at is None:
+            return None
+
+        return datetime.now() - self.context_updated_at
+
+    def save_context_snapshot(self):
+        if self.snapshot_path is None:
+            return
+
+        snapshot = ContextSnapshot(
+            saved_at=self.context_updated_at,
+            sources={key: source.last for key, source in self.sources.items() if source.last is not None},
+            version=SNAPSHOT_VERSION,
         )
+        tmp_path = f"{self.snapshot_path}.tmp"
 
-        self.logger.info(f"Finished updating user context")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def get_calendar_data(self) -> str:
-        if self.context_data.calender is None:
-            return ""
+            # Replace atomically, so a crash while writing never leaves a truncated snapshot behind
+            os.replace(tmp_path, self.snapshot_path)
+        except (OSError, pickle.PicklingError) as e:
+            self.logger.error(f"Could not persist context snapshot: {e}")
+
+    def load_context_snapshot(self):
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return
+
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot: ContextSnapshot = pickle.load(f)
+        except Exception as e:
+            self.logger.error(f"Could not load context snapshot, starting with an empty context: {e}")
+            return
+
+        if getattr(snapshot, "version", None) != SNAPSHOT_VERSION:
+            self.logger.warning("Ignoring context snapshot written by an incompatible version")
+            return
+
+        for key, value in snapshot.sources.items():
+            if key in self.sources:
+                self.sources[key].seed(value.value, value.updated_at)
+
+        self.assemble_user_contexts()
+        self.context_updated_at = snapshot.saved_at
+        self.logger.info(f"Restored context snapshot from {snapshot.saved_at} (age {self.get_context_age()})")
+
+    def get_calendar_data(self, user: UserReportContext) -> List[PromptSection]:
+        context = user.context_data
+
+        if context.calender is None:
+            return []
 
         relevant_until = datetime.combine(datetime.today(), datetime.min.time()).astimezone() + timedelta(days=2)
 
-        def entry_is_relevant(entry) -> bool:
-            begin = entry.begin.astimezone() if isinstance(entry.begin, datetime) else datetime.combine(entry.begin, datetime.min.time()).astimezone()
-            return begin < relevant_until
+        def entry_begin(entry) -> datetime:
+            return entry.begin.astimezone() if isinstance(entry.begin, datetime) else datetime.combine(entry.begin, datetime.min.time()).astimezone()
 
-        entries = [
-            entry for entry in self.context_data.calender.entries
-            if entry_is_relevant(entry)
-        ]
+        # In order of time, so a busy calendar loses its latest entries when the prompt is truncated
+        entries = sorted(
+            (entry for entry in context.calender.entries if entry_begin(entry) < relevant_until),
+            key=entry_begin,
+        )
 
         def todo_is_relevant(todo) -> bool:
             if todo.due is None:
@@ -136,58 +400,95 @@ class AiReportService:
             return due < relevant_until
 
         todos = [
-            todo for todo in self.context_data.calender.todos
+            todo for todo in context.calender.todos
             if todo_is_relevant(todo)
         ]
 
-        results = []
+        note = self.get_age_marker(user, "calender")
+
+        return [
+            PromptSection(
+                title="Calendar entries",
+                entries=[event.format() for event in entries],
+                priority=1,
+                min_entries=self.CALENDAR_MIN_ENTRIES,
+                note=note,
+            ),
+            PromptSection(title="Todo list", entries=[todo.format() for todo in todos], priority=2, note=note),
+        ]
 
-        if len(entries) > 0:
-            results.append("Calendar entries: " + reduce(lambda a, b: f"{a} - {b}", (event.format() for event in entries)))
+    def get_weather_data(self, user: UserReportContext) -> PromptSection | None:
+        context = user.context_data
 
-        if len(todos) > 0:
-            results.append("Todo list: " + reduce(lambda a, b: f"{a} - {b}", (todo.format() for todo in todos)))
+        if context.weather is None or context.weather.forecast is None:
+            return None
 
-        return " | ".join(results)
+        return PromptSection(
+            title=None,
+            entries=[context.weather.forecast],
+            priority=0,
+            min_entries=1,
+            note=self.get_age_marker(user, "weather"),
+        )
 
-    def get_weather_data(self) -> str:
-        if self.context_data.weather is None:
-            return ""
+    def get_train_data(self, user: UserReportContext) -> PromptSection | None:
+        context = user.context_data
 
-        return self.context_data.weather.forecast
+        if (
+                context.train_status is None
+                or context.location is None
+                or context.location.geofence_category != 'home'
+        ):
+            return None
 
-    def get_train_data(self) -> str:
-        if self.context_data.train_status is None or self.context_data.location.geofence_category != 'home':
-            return ""
+        return PromptSection(
+            title=None,
+            entries=[self.traincheck_service.render_departures(context.train_status.departures)],
+            priority=1,
+            note=self.get_age_marker(user, "train_status"),
+        )
 
-        return self.context_data.train_status.train_status
+    def get_shopping_data(self, user: UserReportContext) -> PromptSection | None:
+        context = user.context_data
 
-    def get_shopping_data(self) -> str:
         if (
-                self.context_data.shoppinglist is None
-                or self.context_data.location is None
-                or self.context_data.location.geofence_category != 'grocery-shopping'
+                context.shoppinglist is None
+                or context.location is None
+                or context.location.geofence_category != 'grocery-shopping'
         ):
-            return ""
-
-        if len(self.context_data.shoppinglist.shopping_list) > 0:
-            return "Shopping list: " + ", ".join([item.name for item in self.context_data.shoppinglist.shopping_list])
+            return None
+
+        if len(context.shoppinglist.shopping_list) > 0:
+            return PromptSection(
+                title="Shopping list",
+                entries=[item.name for item in context.shoppinglist.shopping_list],
+                priority=1,
+                separator=", ",
+                note=self.get_age_marker(user, "shoppinglist"),
+            )
         else:
-            return "Nothing on shopping list"
-
-    def get_relevant_skill_data(self) -> str:
-        data = [
-            self.get_calendar_data(),
-            self.get_weather_data(),
-            self.get_train_data(),
-            self.get_shopping_data(),
-        ]
-        return reduce(lambda a, b: f"{a} | {b}", (details for details in data if len(details) > 0))
+            return PromptSection(title=None, entries=["Nothing on shopping list"], priority=1)
+
+    def get_relevant_skill_data(self, user: UserReportContext) -> Prompt:
+        builder = PromptBuilder(self.prompt_token_budget)
+
+        for section in self.get_calendar_data(user):
+            builder.add_section(section)
 
-    async def generate_text_report(self) -> str:
-        skill_data = self.get_relevant_skill_data()
+        builder.add_section(self.get_weather_data(user))
+        builder.add_section(self.get_train_data(user))
+        builder.add_section(self.get_shopping_data(user))
 
-        self.logger.info(f"Generating text report for {skill_data}")
+        return builder.build()
+
+    def get_context_digest(self, prompt: Prompt) -> str:
+        # The digest covers the rendered skill data, so it only changes if the report input changes
+        return hashlib.sha256(prompt.text.encode()).hexdigest()
+
+    def get_report_key(self, prompt: Prompt) -> Tuple[str, int]:
+        return self.get_context_digest(prompt), int(time.time() // self.report_time_bucket)
+
+    def complete_text_report(self, user_name: str, skill_data: str) -> str:
         now_str = datetime.now().astimezone().strftime("%H:%M")
 
         response = self.client.chat.completions.create(
@@ -201,7 +502,7 @@ class AiReportService:
                         f"Do not say you do not have anymore info and do not give too much advice. Answer in german. "
                         f"Do not say you are not trained for something. Mention if the weather needs special clothing. "
                         f"Do not use emojis or formatting. Do not make up stuff and never ask questions. "
-                        f"The user is named {self.user_name}, always start with a greeting. The current time is {now_str}"
+                        f"The user is named {user_name}, always start with a greeting. The current time is {now_str}"
                 },
                 {
                     "role": "user",
@@ -210,37 +511,157 @@ class AiReportService:
             ]
         )
 
-        response_text = response.choices[0].message.content
-        return response_text
+        return response.choices[0].message.content
+
+    def store_report(self, user: UserReportContext, report: CachedReport):
+        user.reports[(report.digest, report.time_bucket)] = report
+        user.latest_report = report
+
+        for key, cached in list(user.reports.items()):
+            if cached.age() > self.max_report_age:
+                del user.reports[key]
+
+    async def build_report(self, user: UserReportContext, with_audio: bool) -> CachedReport:
+        async with user.report_lock:
+            prompt = self.get_relevant_skill_data(user)
+            digest, time_bucket = self.get_report_key(prompt)
+            report = user.reports.get((digest, time_bucket))
+
+            if report is None:
+                self.logger.info(
+                    f"Generating text report for {user.profile.name} from prompt with ~{prompt.estimated_tokens} tokens "
+                    f"(truncated: {prompt.truncated_sections}): {prompt.text}"
+                )
+                text = await asyncio.to_thread(self.complete_text_report, user.profile.name, prompt.text)
+                report = CachedReport(
+                    digest=digest,
+                    time_bucket=time_bucket,
+                    text=text,
+                    generated_at=datetime.now(),
+                    prompt_tokens=prompt.estimated_tokens,
+                )
+                self.store_report(user, report)
+
+            if with_audio and self.DEFAULT_AUDIO_FORMAT not in report.audio:
+                output_format = OUTPUT_FORMATS[self.DEFAULT_AUDIO_FORMAT]
+                report.audio[output_format.name] = await self.synthesize_report(report, output_format)
+
+            return report
+
+    async def synthesize_report(self, report: CachedReport, output_format: OutputFormat) -> bytes:
+        return b"".join([segment async for segment in self.stream_tts(report.text, output_format)])
+
+    async def precompute_reports(self):
+        for user in self.users.values():
+            # Only a changed context is worth a new report, the time bucket only scopes the cache lookups
+            digest = self.get_context_digest(self.get_relevant_skill_data(user))
 
-    async def generate_voice_report(self):
-        response = await self.generate_text_report()
-        for chunk in self.generate_tts(response):
-            yield chunk
+            if user.latest_report is not None and user.latest_report.digest == digest:
+                continue
 
-    def generate_tts(self, text: str):
+            self.logger.info(f"Context of {user.profile.name} changed, precomputing report")
+            await self.build_report(user, with_audio=True)
+
+    async def precompute_reports_in_background(self):
+        async with self.lanes.admit(LOW):
+            await self.precompute_reports()
+
+    def get_servable_report(self, user: UserReportContext) -> CachedReport | None:
+        if user.latest_report is not None and user.latest_report.age() <= self.max_report_age:
+            return user.latest_report
+
+        return None
+
+    async def generate_text_report(self, user: UserReportContext) -> str:
+        report = self.get_servable_report(user)
+
+        if report is None:
+            report = await self.build_report(user, with_audio=False)
+
+        return report.text
+
+    async def generate_voice_report(self, user: UserReportContext, output_format: OutputFormat):
+        report = self.get_servable_report(user)
+
+        if report is None:
+            report = await self.build_report(user, with_audio=False)
+
+        if output_format.name in report.audio:
+            yield report.audio[output_format.name]
+            return
+
+        # Stream the first segments while the rest is still synthesized, and keep the audio for the next request
+        segments = []
+
+        async for segment in self.stream_tts(report.text, output_format):
+            segments.append(segment)
+            yield segment
+
+        report.audio[output_format.name] = b"".join(segments)
+
+    def generate_tts(self, text: str, response_format: str = "mp3"):
         with self.client.audio.speech.with_streaming_response.create(
                 model="tts-1",
                 voice="nova",
                 input=text,
+                response_format=response_format,
         ) as response:
             for chunk in response.iter_bytes():
                 yield chunk
 
-    async def generate_structured_report(self, parsed_location):
+    async def synthesize_tts_chunk(self, text: str, output_format: OutputFormat) -> bytes:
+        return await asyncio.to_thread(lambda: b"".join(self.generate_tts(text, output_format.openai_format)))
+
+    def stream_tts(self, text: str, output_format: OutputFormat) -> AsyncIterator[bytes]:
+        chunks = split_text(text, self.TTS_CHUNK_CHARS)
+        segments = synthesize_chunked(
+            chunks,
+            lambda chunk: self.synthesize_tts_chunk(chunk, output_format),
+            self.tts_parallelism,
+            output_format.create_stitcher,
+        )
+
+        if output_format.sample_rate is not None and output_format.sample_rate != OPENAI_PCM_SAMPLE_RATE:
+            # Resampled while streaming, the stitched audio is never held in memory as a whole
+            segments = convert_stream(
+                segments,
+                PcmResampler(OPENAI_PCM_SAMPLE_RATE, output_format.sample_rate).convert,
+            )
+
+        return segments
+
+    async def get_nearby_departures(self, location: Tuple[float, float]) -> Tuple[List[Station], List[Trip] | None]:
+        train_stations = await self.train_service.get_stations(location)
+
+        if len(train_stations) == 0:
+            return train_stations, None
+
+        return train_stations, await self.train_service.get_departures(train_stations[0].id)
+
+    def get_train_check(self, user: UserReportContext) -> List[Departure] | None:
+        # Read from the shared train source refreshed with the context, the endpoint never waits for the board itself
+        if not user.profile.train_station_from:
+            return None
+
+        train_status = user.context_data.train_status
+        return list(train_status.departures.departures) if train_status is not None else None
+
+    async def generate_structured_report(self, user: UserReportContext, parsed_location):
         if not parsed_location:
             return
         else:
             location = parsed_location
 
-        trains = None
-        train_stations = await self.train_service.get_stations(location)
-
-        if len(train_stations) > 0:
-            trains = await self.train_service.get_departures(train_stations[0].id)
+        train_stations, trains = await self.get_nearby_departures(location)
+        shoppinglist = user.context_data.shoppinglist
 
         return StructuredReport(
             trains=trains,
             train_stations=train_stations,
-            shopping_list=self.context_data.shoppinglist.shopping_list,
+            shopping_list=shoppinglist.shopping_list if shoppinglist is not None else [],
+            train_check=self.get_train_check(user),
         )
+
+    def get_structured_report_etag(self, report: StructuredReport) -> str:
+        # The dataclass repr covers every field and is much cheaper than rendering the JSON response
+        return hashlib.sha256(repr(report).encode()).hexdigest()[:32]
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+from .deadline import remaining, without_deadline
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TtlCache(Generic[K, V]):
+    """
+    Small in-memory cache whose entries expire after a fixed time. If max_size is set, the least recently used entry
+    is evicted once the cache is full.
+    """
+
+    def __init__(self, ttl: float, max_size: int | None = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> V | None:
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def age(self, key: K) -> float | None:
+        entry = self.entries.get(key)
+        return None if entry is None else time.monotonic() - (entry[0] - self.ttl)
+
+    def put(self, key: K, value: V):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        if self.max_size is not None:
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key: K | None = None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def get_metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups > 0 else None,
+        )
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Deduplicates concurrent calls for the same key: callers arriving while a fetch is in flight await its result
+    instead of starting their own. The fetch runs without the deadline of the caller that started it, every caller
+    stops waiting at its own deadline instead.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[K, asyncio.Future] = {}
+
+    async def run(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        future = self.in_flight.get(key)
+
+        if future is None:
+            async def call() -> V:
+                return await fetch()
+
+            future = asyncio.get_running_loop().create_task(call(), context=without_deadline())
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+
+        # Shielded, so a caller that gives up does not cancel the fetch the other callers are waiting for
+        return await asyncio.wait_for(asyncio.shield(future), remaining())
@@ -1,6 +1,8 @@
+import threading
+import time
 from dataclasses import dataclass
 from datetime import timedelta, datetime, date
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import caldav
 from icalendar import Calendar, Event
@@ -52,18 +54,42 @@ class TodoEntry:
 class CalendarService:
     client: caldav.DAVClient
     password: str
+    # Unknown calendar names trigger a new discovery at most this often
+    DISCOVERY_INTERVAL = 600
 
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, timeout: float):
         self.url = url
         self.username = username
         self.password = password
 
-        self.client = caldav.DAVClient(url, username=username, password=password)
+        # The calls run in worker threads, which a timeout of the caller cannot stop. Without a timeout of its own,
+        # a hung server would block a thread of the default executor for good.
+        self.client = caldav.DAVClient(url, username=username, password=password, timeout=timeout)
+        # The requests session of the client is not thread-safe, calls from worker threads take turns
+        self.lock = threading.Lock()
+        self.calendars: Dict[str, caldav.Calendar] = {}
+        self.discovered_at: float | None = None
 
-    def get_upcoming_events_and_todos(self, calendar_names: List[str], days_ahead):
-        # Get all calendars
-        calendars = self.client.principal().calendars()
+    def get_calendars(self, calendar_names: List[str]) -> List[caldav.Calendar]:
+        # Calendars are discovered once and reused, instead of asking the principal again for every fetch
+        missing = any(name not in self.calendars for name in calendar_names)
+
+        if self.discovered_at is None or (missing and time.monotonic() - self.discovered_at > self.DISCOVERY_INTERVAL):
+            self.calendars = {calendar.name: calendar for calendar in self.client.principal().calendars()}
+            self.discovered_at = time.monotonic()
 
+        return [self.calendars[name] for name in calendar_names if name in self.calendars]
+
+    def get_upcoming_events_and_todos(self, calendar_names: List[str], days_ahead):
+        with self.lock:
+            try:
+                return self.fetch_upcoming_events_and_todos(self.get_calendars(calendar_names), days_ahead)
+            except Exception:
+                # A calendar may have been removed, discover them again next time
+                self.discovered_at = None
+                raise
+
+    def fetch_upcoming_events_and_todos(self, calendars: List[caldav.Calendar], days_ahead):
         now = datetime.now()
         end_date = now + timedelta(days=days_ahead)
 
@@ -71,8 +97,6 @@ class CalendarService:
         todos = []
 
         for calendar in calendars:
-            if calendar.name not in calendar_names:
-                continue
 
             results = calendar.search(comp_class=caldav.objects.Event, start=now, end=end_date, expand=True, split_expanded=False)
 
@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Context, copy_context
+
+import aiohttp
+
+# Monotonic time by which the current request has to be answered, None outside of a request
+current_deadline: ContextVar[float | None] = ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Sets the deadline for everything awaited within the block, including tasks started from it. A deadline that is
+    already set is never extended.
+    """
+    until = time.monotonic() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(until if outer is None else min(outer, until))
+
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def without_deadline() -> Context:
+    """
+    Copy of the current context without a deadline, for work that outlives the request that started it.
+    """
+    context = copy_context()
+    context.run(current_deadline.set, None)
+    return context
+
+
+def remaining() -> float | None:
+    until = current_deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+def remaining_or(default: float | None) -> float | None:
+    left = remaining()
+
+    if left is None:
+        return default
+
+    if left <= 0:
+        raise DeadlineExceeded()
+
+    return left if default is None else min(left, default)
+
+
+def client_timeout(default: float | None = None) -> aiohttp.ClientTimeout:
+    """
+    Timeout for upstream requests, bounded by the deadline of the current request. Without a deadline, the default
+    is used or aiohttp's own default if there is none.
+    """
+    total = remaining_or(default)
+    return aiohttp.ClientTimeout(total=total) if total is not None else aiohttp.client.DEFAULT_TIMEOUT
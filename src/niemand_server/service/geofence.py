@@ -0,0 +1,175 @@
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from ..util import distance, EARTH_RADIUS_M
+
+Point = Tuple[float, float]
+
+AREA_PATTERN = re.compile(r"^\s*(CIRCLE|POLYGON|LINESTRING)\s*\(+(.*?)\)+\s*$", re.IGNORECASE)
+
+
+def parse_coordinates(text: str) -> List[Point]:
+    # Traccar writes coordinates as "latitude longitude"
+    return [
+        (float(latitude), float(longitude))
+        for latitude, longitude in (pair.split() for pair in text.split(","))
+    ]
+
+
+def offset_point(point: Point, meters: float, bearing: float) -> Point:
+    latitude = point[0] + math.degrees(meters * math.cos(bearing) / EARTH_RADIUS_M)
+    longitude = point[1] + math.degrees(
+        meters * math.sin(bearing) / (EARTH_RADIUS_M * math.cos(math.radians(point[0])))
+    )
+    return latitude, longitude
+
+
+@dataclass
+class Geofence:
+    id: int
+    name: str
+    category: str | None
+    kind: str
+    points: List[Point]
+    radius: float
+    bbox: Tuple[float, float, float, float]
+
+    def area(self) -> float:
+        return (self.bbox[2] - self.bbox[0]) * (self.bbox[3] - self.bbox[1])
+
+    def in_bbox(self, point: Point) -> bool:
+        return self.bbox[0] <= point[0] <= self.bbox[2] and self.bbox[1] <= point[1] <= self.bbox[3]
+
+    def contains_points(self, points: List[Point]) -> List[bool]:
+        if self.kind == "CIRCLE":
+            return [distance(self.points[0], point) <= self.radius for point in points]
+        elif self.kind == "POLYGON":
+            return self.points_in_polygon(points)
+        else:
+            return [self.distance_to_line(point) <= self.radius for point in points]
+
+    def points_in_polygon(self, points: List[Point]) -> List[bool]:
+        # Ray casting, edges are prepared once and then tested against all points of the batch
+        edges = [
+            (a[0], a[1], b[0], b[1], (b[1] - a[1]) / (b[0] - a[0]))
+            for a, b in zip(self.points, self.points[1:] + self.points[:1])
+            if a[0] != b[0]
+        ]
+        results = []
+
+        for latitude, longitude in points:
+            inside = False
+
+            for lat_a, lon_a, lat_b, lon_b, slope in edges:
+                if (lat_a > latitude) != (lat_b > latitude) and longitude < lon_a + (latitude - lat_a) * slope:
+                    inside = not inside
+
+            results.append(inside)
+
+        return results
+
+    def distance_to_line(self, point: Point) -> float:
+        best = math.inf
+
+        for a, b in zip(self.points, self.points[1:]):
+            # Project onto the segment in a local planar approximation
+            scale = math.cos(math.radians(point[0]))
+            ax, ay, bx, by = a[1] * scale, a[0], b[1] * scale, b[0]
+            px, py = point[1] * scale, point[0]
+            length = (bx - ax) ** 2 + (by - ay) ** 2
+            t = 0 if length == 0 else max(0, min(1, ((px - ax) * (bx - ax) + (py - ay) * (by - ay)) / length))
+            best = min(best, distance(point, (ay + t * (by - ay), (ax + t * (bx - ax)) / scale)))
+
+        return best
+
+
+def parse_geofence(geofence: dict) -> Geofence | None:
+    match = AREA_PATTERN.match(geofence.get('area') or "")
+
+    if match is None:
+        return None
+
+    kind = match.group(1).upper()
+    attributes = geofence.get('attributes') or {}
+
+    if kind == "CIRCLE":
+        coordinates, radius = match.group(2).rsplit(",", 1)
+        center = parse_coordinates(coordinates)[0]
+        radius = float(radius)
+        north, east = offset_point(center, radius, 0), offset_point(center, radius, math.pi / 2)
+        bbox = (2 * center[0] - north[0], 2 * center[1] - east[1], north[0], east[1])
+        return Geofence(geofence['id'], geofence['name'], attributes.get('category'), kind, [center], radius, bbox)
+
+    points = parse_coordinates(match.group(2))
+    radius = float(attributes.get('polylineDistance', 25)) if kind == "LINESTRING" else 0
+    padding = math.degrees(radius / EARTH_RADIUS_M)
+    # Longitude degrees get shorter towards the poles, pad them accordingly
+    lon_padding = padding / max(math.cos(math.radians(points[0][0])), 0.1)
+    bbox = (
+        min(p[0] for p in points) - padding,
+        min(p[1] for p in points) - lon_padding,
+        max(p[0] for p in points) + padding,
+        max(p[1] for p in points) + lon_padding,
+    )
+    return Geofence(geofence['id'], geofence['name'], attributes.get('category'), kind, points, radius, bbox)
+
+
+class GeofenceIndex:
+    """
+    Bounding box grid over the geofence geometries, used to classify positions locally instead of asking Traccar.
+    """
+
+    CELL_SIZE = 0.01
+
+    def __init__(self, geofences: List[dict]):
+        self.geofences: Dict[int, Geofence] = {}
+        self.cells: Dict[Tuple[int, int], List[Geofence]] = {}
+
+        for raw in geofences:
+            try:
+                geofence = parse_geofence(raw)
+            except (ValueError, IndexError, KeyError) as e:
+                logging.getLogger(__name__).warning(f"Could not parse area of geofence {raw.get('id')}: {e}")
+                continue
+
+            if geofence is None:
+                continue
+
+            self.geofences[geofence.id] = geofence
+
+            for lat_cell in range(self.get_cell(geofence.bbox[0]), self.get_cell(geofence.bbox[2]) + 1):
+                for lon_cell in range(self.get_cell(geofence.bbox[1]), self.get_cell(geofence.bbox[3]) + 1):
+                    self.cells.setdefault((lat_cell, lon_cell), []).append(geofence)
+
+    def get_cell(self, value: float) -> int:
+        return math.floor(value / self.CELL_SIZE)
+
+    def classify(self, points: List[Point]) -> List[List[Geofence]]:
+        """
+        Returns the geofences containing each point, smallest geofence first. Points are grouped by candidate
+        geofence, so every geometry is tested once against all points that fall into its bounding box.
+        """
+        candidates: Dict[int, List[int]] = {}
+
+        for idx, point in enumerate(points):
+            for geofence in self.cells.get((self.get_cell(point[0]), self.get_cell(point[1])), ()):
+                if geofence.in_bbox(point):
+                    candidates.setdefault(geofence.id, []).append(idx)
+
+        results: List[List[Geofence]] = [[] for _ in points]
+
+        for geofence_id, point_indices in candidates.items():
+            geofence = self.geofences[geofence_id]
+            inside = geofence.contains_points([points[idx] for idx in point_indices])
+
+            for idx, is_inside in zip(point_indices, inside):
+                if is_inside:
+                    results[idx].append(geofence)
+
+        for result in results:
+            result.sort(key=lambda geofence: geofence.area())
+
+        return results
@@ -0,0 +1,110 @@
+import re
+from typing import Dict, List, Set, Tuple
+
+from ..skill.skill import ProcessResponseContext, NluProcessResponseContext, NluProcessResponseIntent, NluProcessEntity
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+ON_WORDS = {"an", "ein", "einschalten", "anschalten", "anmachen", "einmachen"}
+OFF_WORDS = {"aus", "ausschalten", "abschalten", "ausmachen"}
+# Words that carry no meaning for a switch command. Anything else makes the matcher defer to Rasa.
+FILLER_WORDS = {"bitte", "schalte", "schalt", "schalten", "mach", "mache", "machen", "mal", "den", "die", "das", "der",
+                "dem", "im", "in", "und"}
+
+MATCHER_EXTRACTOR = "FastPathMatcher"
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class FastPathMatcher:
+    """
+    Token trie over the openHAB device and room names. An utterance is matched only if it consists entirely of known
+    names, exactly one on/off direction and filler words, everything else is left to Rasa.
+    """
+
+    def __init__(self, device_names: List[str], location_names: List[str]):
+        # Every trie node maps a token to its child node. Under None, a complete phrase maps its kinds to the original
+        # names, which are emitted as entities because openHAB matches labels and synonyms exactly.
+        self.root: Dict = {}
+
+        for kind, names in (("device", device_names), ("room", location_names)):
+            for name in names:
+                tokens = tokenize(name)
+
+                if len(tokens) == 0:
+                    continue
+
+                node = self.root
+
+                for token in tokens:
+                    node = node.setdefault(token, {})
+
+                node.setdefault(None, {}).setdefault(kind, set()).add(name)
+
+    def longest_match(self, tokens: List[str], start: int) -> Tuple[int, Dict[str, Set[str]] | None]:
+        node = self.root
+        end, kinds = start, None
+
+        for idx in range(start, len(tokens)):
+            node = node.get(tokens[idx])
+
+            if node is None:
+                break
+
+            if None in node:
+                end, kinds = idx + 1, node[None]
+
+        return end, kinds
+
+    def match(self, utterance: str, site: str | None) -> ProcessResponseContext | None:
+        tokens = tokenize(utterance)
+        devices, rooms, commands = [], [], set()
+        idx = 0
+
+        while idx < len(tokens):
+            end, kinds = self.longest_match(tokens, idx)
+
+            if kinds is not None:
+                # A name that is both a device and a room is ambiguous, as are different names spoken the same way
+                if len(kinds) != 1:
+                    return None
+
+                kind, names = next(iter(kinds.items()))
+
+                if len({name.lower() for name in names}) != 1:
+                    return None
+
+                (devices if kind == "device" else rooms).append(min(names))
+                idx = end
+                continue
+
+            token = tokens[idx]
+
+            if token in ON_WORDS:
+                commands.add("smarthome_turn_on")
+            elif token in OFF_WORDS:
+                commands.add("smarthome_turn_off")
+            elif token not in FILLER_WORDS:
+                return None
+
+            idx += 1
+
+        if len(commands) != 1 or len(devices) == 0 or len(rooms) > 1:
+            return None
+
+        entities = [
+            NluProcessEntity(entity=entity, confidence=1.0, value=value, extractor=MATCHER_EXTRACTOR)
+            for entity, values in (("device", devices), ("room", rooms))
+            for value in values
+        ]
+
+        return ProcessResponseContext(
+            nlu=NluProcessResponseContext(
+                intent=NluProcessResponseIntent(name=commands.pop(), confidence=1.0),
+                entities=entities,
+            ),
+            utterance=utterance,
+            site=site,
+        )
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def get_metrics(self) -> dict:
+        return dict(
+            concurrency=self.concurrency,
+            active=self.active,
+            queue_depth=len(self.waiting),
+            admitted=self.admitted,
+            average_wait_ms=self.total_wait / self.admitted * 1000 if self.admitted > 0 else None,
+            max_wait_ms=self.max_wait * 1000,
+        )
+
+
+class PriorityLanes:
+    """
+    Admission control for work of different priority. Every lane runs at most its quota of tasks at once, and a lane
+    only admits waiting work while no lane of higher priority has work waiting.
+    """
+
+    def __init__(self, high_concurrency: int, normal_concurrency: int, low_concurrency: int):
+        # In order of priority
+        self.lanes: Dict[str, Lane] = {
+            HIGH: Lane(HIGH, high_concurrency),
+            NORMAL: Lane(NORMAL, normal_concurrency),
+            LOW: Lane(LOW, low_concurrency),
+        }
+
+    def higher_lanes_waiting(self, lane: Lane) -> bool:
+        for other in self.lanes.values():
+            if other is lane:
+                return False
+
+            if len(other.waiting) > 0:
+                return True
+
+        return False
+
+    def dispatch(self):
+        for lane in self.lanes.values():
+            while len(lane.waiting) > 0 and lane.active < lane.concurrency:
+                future = lane.waiting.popleft()
+
+                if not future.done():
+                    lane.active += 1
+                    future.set_result(None)
+
+            if len(lane.waiting) > 0:
+                return
+
+    @asynccontextmanager
+    async def admit(self, lane_name: str):
+        lane = self.lanes[lane_name]
+        start = time.perf_counter()
+
+        if lane.active < lane.concurrency and len(lane.waiting) == 0 and not self.higher_lanes_waiting(lane):
+            lane.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            lane.waiting.append(future)
+
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    if future in lane.waiting:
+                        lane.waiting.remove(future)
+                else:
+                    # Admitted right before the cancellation, hand the slot on
+                    lane.active -= 1
+
+                self.dispatch()
+                raise
+
+        lane.record_wait(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            lane.active -= 1
+            self.dispatch()
+
+    def get_metrics(self) -> dict:
+        return {name: lane.get_metrics() for name, lane in self.lanes.items()}
@@ -1,10 +1,17 @@
+import asyncio
+import logging
+import math
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
 
 from dateutil import parser
 
 import aiohttp
 
+from .cache import TtlCache, SingleFlight
+from .geofence import GeofenceIndex, offset_point
+
 
 @dataclass
 class DeviceLocation:
@@ -14,71 +21,188 @@ class DeviceLocation:
     longitude: float
     geofence_name: str | None
     geofence_category: str | None
+    geofence_id: int | None = None
+
+
+LocationListener = Callable[[str, DeviceLocation, DeviceLocation | None], Awaitable[None]]
 
 
 class LocationService:
-    def __init__(self, traccar_base_url: str, traccar_username: str, traccar_password: str):
+    MAX_RECONNECT_DELAY = 300
+    # Bearings of the points on the accuracy circle that are classified together with the reported position
+    ACCURACY_BEARINGS = (0, math.pi / 2, math.pi, 3 * math.pi / 2)
+
+    def __init__(self, traccar_base_url: str, traccar_username: str, traccar_password: str, geofence_cache_ttl: int):
+        self.logger = logging.getLogger(__name__)
         self.base_url = traccar_base_url
+        self.username = traccar_username
+        self.password = traccar_password
         self.auth = aiohttp.BasicAuth(traccar_username, traccar_password)
+        self.session: aiohttp.ClientSession | None = None
+
+        # Geofences rarely change, all of them are loaded at once and revalidated when the cache expires
+        self.geofences: TtlCache[str, Dict[int, dict]] = TtlCache(geofence_cache_ttl)
+        self.geofence_fetches: SingleFlight[str, Dict[int, dict]] = SingleFlight()
+        self.geofence_index = GeofenceIndex([])
+
+        # Latest locations pushed by the Traccar websocket, keyed by device id
+        self.locations: Dict[str, DeviceLocation] = {}
+        self.connected = False
+        self.listeners: List[LocationListener] = []
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            # Traccar is often addressed by IP, whose cookies the default jar rejects. The websocket needs the
+            # session cookie.
+            self.session = aiohttp.ClientSession(auth=self.auth, cookie_jar=aiohttp.CookieJar(unsafe=True))
+
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def add_listener(self, listener: LocationListener):
+        self.listeners.append(listener)
 
     async def get_device(self, device_id):
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            try:
-                async with session.get(f"{self.base_url}/api/devices?id={device_id}") as response:
-                    response.raise_for_status()
-                    device = (await response.json())[0]
-                    return device
-            except aiohttp.ClientError as e:
-                print(f"Error fetching device: {e}")
-                return None
+        async with self.get_session().get(f"{self.base_url}/api/devices?id={device_id}") as response:
+            response.raise_for_status()
+            devices = await response.json()
+            return devices[0] if len(devices) > 0 else None
 
     async def get_position(self, position_id):
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            try:
-                async with session.get(f"{self.base_url}/api/positions?id={position_id}") as response:
-                    response.raise_for_status()
-                    position = await response.json()
-                    return position
-            except aiohttp.ClientError as e:
-                print(f"Error fetching position: {e}")
-                return None
+        async with self.get_session().get(f"{self.base_url}/api/positions?id={position_id}") as response:
+            response.raise_for_status()
+            positions = await response.json()
+            return positions[0] if len(positions) > 0 else None
+
+    async def fetch_geofences(self) -> Dict[int, dict]:
+        async with self.get_session().get(f"{self.base_url}/api/geofences") as response:
+            response.raise_for_status()
+            geofences = {geofence['id']: geofence for geofence in await response.json()}
+
+        self.geofence_index = GeofenceIndex(list(geofences.values()))
+        self.geofences.put("all", geofences)
+        return geofences
+
+    async def get_geofences(self) -> Dict[int, dict]:
+        geofences = self.geofences.get("all")
+
+        if geofences is None:
+            geofences = await self.geofence_fetches.run("all", self.fetch_geofences)
+
+        return geofences
 
     async def get_geofence(self, geofence_id):
-        async with aiohttp.ClientSession(auth=self.auth) as session:
-            try:
-                async with session.get(f"{self.base_url}/api/geofences/{geofence_id}") as response:
-                    response.raise_for_status()
-                    geofence = await response.json()
-                    return geofence
-            except aiohttp.ClientError as e:
-                print(f"Error fetching geofence: {e}")
-                return None
+        return (await self.get_geofences()).get(geofence_id)
+
+    async def resolve_geofence(self, position: dict, previous: DeviceLocation | None) -> dict | None:
+        geofences = await self.get_geofences()
+
+        if len(self.geofence_index.geofences) == 0:
+            # No geometry could be parsed, rely on the geofences Traccar matched
+            return geofences.get(position['geofenceIds'][0]) if position.get('geofenceIds') else None
+
+        point = (position['latitude'], position['longitude'])
+        accuracy = position.get('accuracy') or 0
+        candidates = [point] + [offset_point(point, accuracy, bearing) for bearing in self.ACCURACY_BEARINGS if accuracy > 0]
+        matches = self.geofence_index.classify(candidates)
+        center_match = matches[0][0] if len(matches[0]) > 0 else None
+
+        # Hysteresis: the previous geofence is kept while any point within the accuracy radius is still inside it,
+        # unless the position moved into a smaller, more specific geofence
+        previous_geofence = self.geofence_index.geofences.get(previous.geofence_id) if previous is not None else None
+
+        if previous_geofence is not None and any(geofence.id == previous_geofence.id for match in matches for geofence in match):
+            if center_match is None or center_match.area() >= previous_geofence.area():
+                return geofences.get(previous_geofence.id)
+
+        return geofences.get(center_match.id) if center_match is not None else None
+
+    async def to_device_location(self, position: dict, previous: DeviceLocation | None = None) -> DeviceLocation:
+        geofence = await self.resolve_geofence(position, previous)
+
+        return DeviceLocation(
+            location_time=parser.isoparse(position['deviceTime']),
+            accuracy=position['accuracy'],
+            latitude=position['latitude'],
+            longitude=position['longitude'],
+            geofence_name=geofence['name'] if geofence is not None else None,
+            geofence_category=(geofence.get('attributes') or {}).get('category') if geofence is not None else None,
+            geofence_id=geofence['id'] if geofence is not None else None,
+        )
 
     async def get_device_location(self, device_id) -> DeviceLocation | None:
+        # While the websocket is connected, pushed positions are always up to date
+        if self.connected and str(device_id) in self.locations:
+            return self.locations[str(device_id)]
+
         device = await self.get_device(device_id)
-        if device and 'positionId' in device:
-            position_id = device['positionId']
-            position = (await self.get_position(position_id))[0]
-            geofence = None
-            geofence_category = None
-
-            if position['geofenceIds'] is not None and len(position['geofenceIds']) > 0:
-                geofence_id = position['geofenceIds'][0]
-                geofence = await self.get_geofence(geofence_id)
-
-                if 'attributes' in geofence:
-                    geofence_category = geofence['attributes']['category']
-
-            device_location = DeviceLocation(
-                location_time=parser.isoparse(position['deviceTime']),
-                accuracy = position['accuracy'],
-                latitude = position['latitude'],
-                longitude = position['longitude'],
-                geofence_name = geofence['name'] if geofence is not None else None,
-                geofence_category = geofence_category
-            )
-
-            return device_location
-        else:
-            print("No position ID found for the device.")
-            return None
\ No newline at end of file
+
+        if device is None or device.get('positionId') is None:
+            self.logger.warning(f"No position ID found for device {device_id}")
+            return None
+
+        position = await self.get_position(device['positionId'])
+
+        if position is None:
+            self.logger.warning(f"Position {device['positionId']} of device {device_id} not found")
+            return None
+
+        return await self.to_device_location(position, self.locations.get(str(device_id)))
+
+    async def handle_positions(self, positions: List[dict]):
+        for position in positions:
+            device_id = str(position['deviceId'])
+            previous = self.locations.get(device_id)
+            location = await self.to_device_location(position, previous)
+            self.locations[device_id] = location
+
+            for listener in self.listeners:
+                try:
+                    await listener(device_id, location, previous)
+                except Exception as e:
+                    self.logger.error(f"Location listener failed: {e!r}")
+
+    async def listen(self):
+        """
+        Keeps a Traccar websocket open and stores every pushed position. Reconnects with exponential backoff.
+        """
+        delay = 1
+        ws_url = self.base_url.replace("http", "ws", 1) + "/api/socket"
+
+        while True:
+            try:
+                session = self.get_session()
+
+                # The websocket is authenticated by the session cookie
+                async with session.post(
+                        f"{self.base_url}/api/session",
+                        data=dict(email=self.username, password=self.password),
+                ) as response:
+                    response.raise_for_status()
+
+                async with session.ws_connect(ws_url, heartbeat=60) as ws:
+                    self.logger.info("Connected to Traccar websocket")
+                    self.connected = True
+                    delay = 1
+
+                    async for message in ws:
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            break
+
+                        data = message.json()
+
+                        if 'positions' in data:
+                            await self.handle_positions(data['positions'])
+            except asyncio.CancelledError:
+                self.connected = False
+                raise
+            except Exception as e:
+                self.logger.warning(f"Traccar websocket failed: {e!r}")
+
+            self.connected = False
+            self.logger.info(f"Reconnecting to Traccar websocket in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
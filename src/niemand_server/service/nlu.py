@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from typing import List, Tuple
+
+import aiohttp
+
+from .cache import TtlCache, SingleFlight
+from .deadline import client_timeout
+from .intent_matcher import FastPathMatcher, tokenize
+from .openhab import OpenhabService
+from ..skill.skill import ProcessResponseContext, map_context
+
+
+class NluService:
+    # Weight of the latest request in the moving average of the Rasa latency
+    LATENCY_SMOOTHING = 0.1
+    # Parse requests are hedged once enough latencies are known to estimate the 95th percentile
+    HEDGE_MIN_SAMPLES = 20
+    LATENCY_WINDOW = 200
+    MAX_ATTEMPTS = 2
+
+    def __init__(self, rasa_base_uri: str, openhab_service: OpenhabService, parse_cache_ttl: int,
+                 parse_cache_size: int):
+        self.logger = logging.getLogger(__name__)
+        self.rasa_base_uri = rasa_base_uri
+
+        # Rasa results by normalized utterance, only valid for the model that produced them
+        self.parse_cache: TtlCache[str, ProcessResponseContext] = TtlCache(parse_cache_ttl, parse_cache_size)
+        self.model_id: str | None = None
+        self.parse_flights: SingleFlight[str, dict] = SingleFlight()
+
+        device_names, location_names = openhab_service.get_injections()
+        self.matcher = FastPathMatcher(device_names, location_names)
+
+        self.fast_path_hits = 0
+        self.fast_path_misses = 0
+        self.fast_path_time = 0.0
+        self.rasa_latency: float | None = None
+        self.latency_saved = 0.0
+        self.latencies: deque = deque(maxlen=self.LATENCY_WINDOW)
+        self.hedged_requests = 0
+        self.retried_requests = 0
+
+    def record_rasa_latency(self, latency: float):
+        if self.rasa_latency is None:
+            self.rasa_latency = latency
+        else:
+            self.rasa_latency += self.LATENCY_SMOOTHING * (latency - self.rasa_latency)
+
+    async def check_model(self):
+        async with aiohttp.ClientSession(timeout=client_timeout(10)) as session:
+            async with session.get(f'{self.rasa_base_uri}/status') as result:
+                result.raise_for_status()
+                status = await result.json()
+
+        model_id = status.get('model_id') or status.get('model_file')
+
+        if model_id != self.model_id:
+            if self.model_id is not None:
+                self.logger.info(f"Rasa model changed from {self.model_id} to {model_id}, clearing the parse cache")
+
+            self.parse_cache.invalidate()
+            self.model_id = model_id
+
+    def get_hedge_delay(self) -> float | None:
+        if len(self.latencies) < self.HEDGE_MIN_SAMPLES:
+            return None
+
+        return statistics.quantiles(self.latencies, n=20)[-1]
+
+    async def request_parse(self, utterance: str) -> dict:
+        start = time.perf_counter()
+
+        async with aiohttp.ClientSession(timeout=client_timeout()) as session:
+            async with session.post(f'{self.rasa_base_uri}/model/parse', json=dict(text=utterance)) as result:
+                result.raise_for_status()
+                result_json = await result.json()
+
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        self.record_rasa_latency(latency)
+        return result_json
+
+    async def request_parse_hedged(self, utterance: str) -> dict:
+        """
+        Sends a second parse request if the first one takes longer than 95 % of the recent ones, or if it fails,
+        and returns whichever answer arrives first. Every request is bounded by the deadline of the current request.
+        """
+        pending = {asyncio.ensure_future(self.request_parse(utterance))}
+        attempts = 1
+        hedge_delay = self.get_hedge_delay()
+        error = None
+
+        try:
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                hedge_delay = None
+
+                if len(done) == 0:
+                    self.hedged_requests += 1
+                    attempts += 1
+                    pending.add(asyncio.ensure_future(self.request_parse(utterance)))
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+
+                    error = task.exception()
+                    self.logger.warning(f"Rasa parse request failed: {error!r}")
+
+                # A timed out request is not retried, the deadline of the request has passed
+                if len(pending) == 0 and attempts < self.MAX_ATTEMPTS and not isinstance(error, TimeoutError):
+                    self.retried_requests += 1
+                    attempts += 1
+                    pending.add(asyncio.ensure_future(self.request_parse(utterance)))
+
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def parse_with_rasa(self, utterance: str, site: str | None) -> ProcessResponseContext:
+        key = " ".join(tokenize(utterance))
+        cached = self.parse_cache.get(key)
+
+        if cached is not None:
+            # The cached models were validated once already, copying them skips the validation
+            return cached.model_copy(update=dict(utterance=utterance, site=site))
+
+        # Identical utterances parsed at the same time, e.g. within a batch, share one request
+        result_json = await self.parse_flights.run(key, lambda: self.request_parse_hedged(utterance))
+        context = map_context(result_json, utterance, site)
+        self.parse_cache.put(key, context)
+        return context
+
+    async def parse(self, utterance: str, site: str | None) -> ProcessResponseContext:
+        start = time.perf_counter()
+        context = self.matcher.match(utterance, site)
+        elapsed = time.perf_counter() - start
+        self.fast_path_time += elapsed
+
+        if context is None:
+            self.fast_path_misses += 1
+            return await self.parse_with_rasa(utterance, site)
+
+        self.fast_path_hits += 1
+
+        if self.rasa_latency is not None:
+            self.latency_saved += max(self.rasa_latency - elapsed, 0)
+
+        self.logger.debug(f"Matched '{utterance}' locally as {context.nlu.intent.name}")
+        return context
+
+    async def parse_batch(self, utterances: List[Tuple[str, str | None]]) -> List[ProcessResponseContext]:
+        return list(await asyncio.gather(*(self.parse(utterance, site) for utterance, site in utterances)))
+
+    def get_metrics(self) -> dict:
+        lookups = self.fast_path_hits + self.fast_path_misses
+        p95 = self.get_hedge_delay()
+        return dict(
+            fast_path_hits=self.fast_path_hits,
+            fast_path_misses=self.fast_path_misses,
+            fast_path_hit_rate=self.fast_path_hits / lookups if lookups > 0 else None,
+            fast_path_average_ms=self.fast_path_time / lookups * 1000 if lookups > 0 else None,
+            rasa_average_ms=self.rasa_latency * 1000 if self.rasa_latency is not None else None,
+            rasa_p95_ms=p95 * 1000 if p95 is not None else None,
+            hedged_requests=self.hedged_requests,
+            retried_requests=self.retried_requests,
+            latency_saved_ms=self.latency_saved * 1000,
+            model_id=self.model_id,
+            parse_cache=self.parse_cache.get_metrics(),
+        )
+
+
+def fallback_context(utterance: str, site: str | None) -> ProcessResponseContext:
+    return map_context(dict(intent=dict(name="nlu_fallback", confidence=0.0), entities=[]), utterance, site)
@@ -1,10 +1,15 @@
+import asyncio
 import logging
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from itertools import chain
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 import aiohttp
 
+from .deadline import client_timeout
+
 
 def load_properties(filepath, sep='=', comment_char='#'):
     """
@@ -60,6 +65,10 @@ class Item:
             return self.name
 
 
+# Commands issued while a batch is collected are only recorded, the batch sends them later in one go
+collected_commands: ContextVar[List[Tuple[Item, str]] | None] = ContextVar("collected_commands", default=None)
+
+
 class OpenhabService:
     def __init__(self, openhab_server_url: str, auth_token: str | None, lang: str):
         self.logger = logging.getLogger(__name__)
@@ -258,19 +267,63 @@ class OpenhabService:
                     (item_type is None or item.item_type == item_type))
                 ))
 
+    @contextmanager
+    def collect_commands(self):
+        commands: List[Tuple[Item, str]] = []
+        token = collected_commands.set(commands)
+
+        try:
+            yield commands
+        finally:
+            collected_commands.reset(token)
+
     async def send_command_to_devices(self, devices, command):
-        self.logger.debug(f"Starting to post {len(devices)} commands...")
+        commands = collected_commands.get()
+
+        if commands is not None:
+            commands.extend((device, command) for device in devices)
+            return
+
+        errors = [error for error in await self.dispatch_commands([(device, command) for device in devices]) if error]
 
-        for device in devices:
-            url = f"{self.openhab_server_url}/rest/items/{device.name}"
+        if len(errors) > 0:
+            raise errors[0]
 
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                await session.post(url, data=command)
+    async def dispatch_commands(self, commands: List[Tuple[Item, str]]) -> List[Exception | None]:
+        """
+        Posts the commands over one session. Different devices are commanded at once, the commands of one device are
+        sent one after another in their order, so e.g. switching a device on and off again keeps both commands.
+        Returns the error of every command, None for the commands openHAB accepted.
+        """
+        self.logger.debug(f"Starting to post {len(commands)} commands...")
+        errors: List[Exception | None] = [None] * len(commands)
+        commands_by_device: Dict[str, List[int]] = {}
+
+        for idx, (device, _) in enumerate(commands):
+            commands_by_device.setdefault(device.name, []).append(idx)
+
+        async with aiohttp.ClientSession(headers=self.headers, timeout=client_timeout()) as session:
+            async def post_in_order(device_name: str, indices: List[int]):
+                for idx in indices:
+                    try:
+                        url = f"{self.openhab_server_url}/rest/items/{device_name}"
+
+                        async with session.post(url, data=commands[idx][1]) as result:
+                            result.raise_for_status()
+                    except (aiohttp.ClientError, TimeoutError) as e:
+                        self.logger.warning(f"openHAB did not accept {commands[idx][1]} for {device_name}: {e!r}")
+                        errors[idx] = e
+
+            await asyncio.gather(*(
+                post_in_order(device_name, indices) for device_name, indices in commands_by_device.items()
+            ))
+
+        return errors
 
     async def get_state(self, item):
         url = f"{self.openhab_server_url}/rest/items/{item.name}"
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
+        async with aiohttp.ClientSession(headers=self.headers, timeout=client_timeout()) as session:
             result = await session.get(url)
 
         if result.status != 200:
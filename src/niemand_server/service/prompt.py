@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field
+from typing import List
+
+
+def estimate_tokens(text: str) -> int:
+    # GPT tokenizers average roughly four characters per token for german and english text
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class PromptSection:
+    title: str | None
+    entries: List[str]
+    # Lower values are more important, sections with the highest value are truncated first
+    priority: int = 0
+    # Entries kept as long as the budget can be met by truncating other sections
+    min_entries: int = 0
+    separator: str = " - "
+    # Shown next to the title, e.g. to mark data that could not be refreshed
+    note: str | None = None
+
+    def render(self, entries: List[str], omitted: int) -> str:
+        text = self.separator.join(entries)
+
+        if omitted > 0:
+            text = f"{text}{self.separator}(+{omitted} weitere)" if text else f"{omitted} Einträge ausgelassen"
+
+        title = self.title
+
+        if self.note is not None:
+            title = f"{title} ({self.note})" if title is not None else f"({self.note})"
+
+        return f"{title}: {text}" if title is not None else text
+
+
+@dataclass
+class Prompt:
+    text: str
+    estimated_tokens: int
+    truncated_sections: List[str] = field(default_factory=list)
+
+
+class PromptBuilder:
+    def __init__(self, token_budget: int, section_separator: str = " | "):
+        self.token_budget = token_budget
+        self.section_separator = section_separator
+        self.sections: List[PromptSection] = []
+
+    def add_section(self, section: PromptSection | None):
+        if section is not None and len(section.entries) > 0:
+            self.sections.append(section)
+
+    def build(self) -> Prompt:
+        entry_costs = [[estimate_tokens(entry + section.separator) for entry in section.entries] for section in self.sections]
+        overhead = [
+            estimate_tokens(f"{section.title or ''} ({section.note or ''}): {self.section_separator}")
+            for section in self.sections
+        ]
+        total = sum(overhead) + sum(sum(costs) for costs in entry_costs)
+
+        kept = [len(section.entries) for section in self.sections]
+        truncated = []
+
+        # Drop entries from the end of the least important sections until the prompt fits into the budget. The first
+        # pass keeps the minimum entries of every section, the second one only runs if that is still too much.
+        by_priority = sorted(range(len(self.sections)), key=lambda i: self.sections[i].priority, reverse=True)
+
+        for keep_minimum in (True, False):
+            for idx in by_priority:
+                if total <= self.token_budget:
+                    break
+
+                floor = self.sections[idx].min_entries if keep_minimum else 0
+
+                if kept[idx] <= floor:
+                    continue
+
+                while kept[idx] > floor and total > self.token_budget:
+                    kept[idx] -= 1
+                    total -= entry_costs[idx][kept[idx]]
+
+                name = self.sections[idx].title or str(idx)
+
+                if name not in truncated:
+                    truncated.append(name)
+
+        text = self.section_separator.join(
+            section.render(section.entries[:kept[idx]], len(section.entries) - kept[idx])
+            for idx, section in enumerate(self.sections)
+        )
+
+        return Prompt(text=text, estimated_tokens=estimate_tokens(text), truncated_sections=truncated)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Generic, List, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class SourceValue(Generic[T]):
+    value: T
+    updated_at: datetime
+    # Set if the latest refresh failed and the value is served from an earlier refresh
+    stale: bool = False
+
+    def age(self) -> timedelta:
+        return datetime.now() - self.updated_at
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 30, max_backoff: float = 900):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.open_until: datetime | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_until is not None and datetime.now() < self.open_until
+
+    def allow_request(self) -> bool:
+        # Once the backoff has passed a single probe request is let through (half-open)
+        return not self.is_open
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = None
+
+    def record_failure(self):
+        self.failures += 1
+
+        if self.failures >= self.failure_threshold:
+            backoff = min(self.base_backoff * 2 ** (self.failures - self.failure_threshold), self.max_backoff)
+            self.open_until = datetime.now() + timedelta(seconds=backoff)
+
+
+class ResilientSource(Generic[T]):
+    """
+    Wraps an upstream fetch with a timeout, a circuit breaker and the last good value, which is served with its age
+    while the upstream is failing.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            fetch: Callable[[], Awaitable[T | None]],
+            timeout: float,
+            refresh_interval: timedelta = timedelta(0),
+            breaker: CircuitBreaker | None = None,
+    ):
+        self.name = name
+        self.fetch = fetch
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.last: SourceValue[T] | None = None
+        self.logger = logging.getLogger(__name__)
+
+    def seed(self, value: T | None, updated_at: datetime):
+        if value is not None:
+            self.last = SourceValue(value=value, updated_at=updated_at, stale=True)
+
+    async def get(self) -> SourceValue[T] | None:
+        if self.last is not None and not self.last.stale and self.last.age() < self.refresh_interval:
+            return self.last
+
+        if not self.breaker.allow_request():
+            self.logger.info(f"Circuit for {self.name} is open until {self.breaker.open_until}, serving last value")
+            return self.mark_stale()
+
+        try:
+            value = await asyncio.wait_for(self.fetch(), self.timeout)
+        except Exception as e:
+            self.logger.warning(f"Updating {self.name} failed: {e!r}")
+            self.breaker.record_failure()
+            return self.mark_stale()
+
+        if value is None:
+            # None means the upstream had no usable answer, which is treated like a failure to keep the last value
+            self.logger.warning(f"Updating {self.name} returned no data")
+            self.breaker.record_failure()
+            return self.mark_stale()
+
+        self.breaker.record_success()
+        self.last = SourceValue(value=value, updated_at=datetime.now())
+        return self.last
+
+    def mark_stale(self) -> SourceValue[T] | None:
+        if self.last is not None:
+            self.last.stale = True
+
+        return self.last
+
+
+class RequestBudget:
+    """
+    Sliding window budget of upstream requests, used to keep optional background traffic below a global limit.
+    """
+
+    def __init__(self, max_requests: int, period: timedelta = timedelta(hours=1)):
+        self.max_requests = max_requests
+        self.period = period
+        self.requests: List[datetime] = []
+
+    def prune(self):
+        threshold = datetime.now() - self.period
+        self.requests = [request for request in self.requests if request > threshold]
+
+    def remaining(self) -> int:
+        self.prune()
+        return max(self.max_requests - len(self.requests), 0)
+
+    def record(self):
+        self.requests.append(datetime.now())
@@ -1,26 +1,120 @@
+import asyncio
+import logging
+import time
 from dataclasses import dataclass
+from typing import Dict, List
 
 import aiohttp
 
+from .cache import SingleFlight
+from .deadline import client_timeout
+
+
 @dataclass
 class ShoppinglistItem:
     name: str
+    description: str = ""
+
+
+@dataclass
+class CachedShoppingList:
+    items: List[ShoppinglistItem]
+    etag: str | None
+    fetched_at: float
+
 
 class ShoppingListService:
-    def __init__(self, kitchenowl_url: str, kitchenowl_access_token: str, shoppinglist_id: str):
+    def __init__(self, kitchenowl_url: str, kitchenowl_access_token: str, shoppinglist_id: str, cache_ttl: int):
+        self.logger = logging.getLogger(__name__)
         self.kitchenowl_url = kitchenowl_url
         self.shoppinglist_id = shoppinglist_id
+        self.cache_ttl = cache_ttl
+        self.lists: Dict[str, CachedShoppingList] = {}
+        self.fetches: SingleFlight[str, List[ShoppinglistItem]] = SingleFlight()
 
         self.headers = {
             'Authorization': f'Bearer {kitchenowl_access_token}'
         }
 
-    async def get_shoppinglist_items(self):
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            payload = dict(
+    async def fetch_shoppinglist_items(self, shoppinglist_id: str) -> List[ShoppinglistItem]:
+        cached = self.lists.get(shoppinglist_id)
+        headers = {'If-None-Match': cached.etag} if cached is not None and cached.etag is not None else {}
+
+        async with aiohttp.ClientSession(headers=self.headers, timeout=client_timeout()) as session:
+            async with session.get(
+                    url=f'{self.kitchenowl_url}/api/shoppinglist/{shoppinglist_id}/items',
+                    headers=headers
+            ) as result:
+                if result.status == 304:
+                    items = cached.items
+                else:
+                    result.raise_for_status()
+                    items = [
+                        ShoppinglistItem(item['name'], item.get('description') or "")
+                        for item in await result.json()
+                    ]
+
+                self.lists[shoppinglist_id] = CachedShoppingList(
+                    items=items,
+                    etag=result.headers.get('ETag'),
+                    fetched_at=time.monotonic(),
+                )
+
+        return items
+
+    async def get_shoppinglist_items(self, shoppinglist_id: str | None = None) -> List[ShoppinglistItem]:
+        shoppinglist_id = shoppinglist_id or self.shoppinglist_id
+        cached = self.lists.get(shoppinglist_id)
+
+        if cached is not None and time.monotonic() - cached.fetched_at < self.cache_ttl:
+            return cached.items
+
+        return await self.fetches.run(shoppinglist_id, lambda: self.fetch_shoppinglist_items(shoppinglist_id))
+
+    async def add_items_to_shopping_list(self, items: List[ShoppinglistItem], shoppinglist_id: str | None = None):
+        """
+        Adds the items at once. If any of them is rejected, the first error is raised after the others were added.
+        """
+        shoppinglist_id = shoppinglist_id or self.shoppinglist_id
+        base_url = f'{self.kitchenowl_url}/api/shoppinglist/{shoppinglist_id}'
+
+        async def add(session: aiohttp.ClientSession, item: ShoppinglistItem):
+            async with session.post(
+                    f'{base_url}/add-item-by-name',
+                    json=dict(name=item.name, description=item.description)
+            ) as result:
+                result.raise_for_status()
+
+        # KitchenOwl adds items one at a time, the requests share one session and run at once
+        async with aiohttp.ClientSession(headers=self.headers, timeout=client_timeout()) as session:
+            outcomes = await asyncio.gather(*(add(session, item) for item in items), return_exceptions=True)
+
+        added = [item for item, outcome in zip(items, outcomes) if outcome is None]
+        errors = [outcome for outcome in outcomes if outcome is not None]
+
+        # Write through, so the cached list stays valid without downloading it again
+        self.write_through(shoppinglist_id, added)
+
+        if len(errors) > 0:
+            self.logger.warning(f"Could not add {len(errors)} of {len(items)} items to the shopping list: {errors[0]}")
+            raise errors[0]
+
+    def write_through(self, shoppinglist_id: str, items: List[ShoppinglistItem]):
+        cached = self.lists.get(shoppinglist_id)
+
+        if cached is not None and len(items) > 0:
+            present = {item.name.lower(): idx for idx, item in enumerate(cached.items)}
+            updated = list(cached.items)
+
+            for item in items:
+                if item.name.lower() in present:
+                    updated[present[item.name.lower()]] = item
+                else:
+                    updated.append(item)
+
+            cached.items = updated
+            cached.etag = None
 
-            )
-            result = await session.get(url=f'{self.kitchenowl_url}/api/shoppinglist/{self.shoppinglist_id}/items', json=payload)
-            result.raise_for_status()
-            items = await result.json()
-            return [ShoppinglistItem(item['name']) for item in items]
\ No newline at end of file
+    async def add_item_to_shopping_list(self, name: str, unit: str | None = None, amount: str | None = None):
+        description = " ".join(str(part) for part in (amount, unit) if part is not None)
+        await self.add_items_to_shopping_list([ShoppinglistItem(name, description)])
@@ -1,4 +1,5 @@
-from typing import List
+from typing import Dict, List, Tuple
+from .cache import TtlCache
 from ..skill.skill import NiemandSkill, SkillResult, ProcessResponseContext
 from ..skill.openhab import OpenHABSkill
 from ..skill.traincheck import TraincheckSkill
@@ -6,9 +7,12 @@ from ..skill.weather import  WeatherSkill
 from ..skill.shopping import ShoppingSkill
 from ..skill.chatgpt import ChatGptSkill
 
+ResultKey = Tuple[Tuple[str, str], ...]
+
 
 class SkillManagerService:
     skills: List[NiemandSkill]
+    RESULT_CACHE_SIZE = 256
 
     def __init__(
             self,
@@ -27,11 +31,51 @@ class SkillManagerService:
             chatgpt_skill,
         ]
 
+        # One cache per intent the skills declared as cacheable, each with the TTL of its intent
+        self.cached_intents: Dict[str, NiemandSkill] = {}
+        self.result_caches: Dict[str, TtlCache[ResultKey, SkillResult]] = {}
+
+        for skill in self.skills:
+            for intent_name, ttl in skill.cached_intents.items():
+                self.cached_intents[intent_name] = skill
+                self.result_caches[intent_name] = TtlCache(ttl, self.RESULT_CACHE_SIZE)
+
+    def get_result_key(self, nlu_result: ProcessResponseContext) -> ResultKey:
+        return tuple(sorted(
+            (entity.entity, str(entity.value).strip().lower()) for entity in nlu_result.nlu.entities
+        ))
+
     async def run_skills(self, nlu_result: ProcessResponseContext) -> SkillResult | None:
+        intent = nlu_result.nlu.intent
+        cache_skill = self.cached_intents.get(intent.name)
+
+        # Results are only reused if the declaring skill would have handled the intent
+        if cache_skill is None or not cache_skill.intent_has_global_min_confidence(intent):
+            _, result = await self.run_skill_chain(nlu_result)
+            return result
+
+        key = self.get_result_key(nlu_result)
+        result = self.result_caches[intent.name].get(key)
+
+        if result is not None:
+            cache_skill.handle_cached_result(nlu_result)
+            return result
+
+        skill, result = await self.run_skill_chain(nlu_result)
+
+        if result is not None and result.success and skill is cache_skill:
+            self.result_caches[intent.name].put(key, result)
+
+        return result
+
+    async def run_skill_chain(self, nlu_result: ProcessResponseContext) -> Tuple[NiemandSkill | None, SkillResult | None]:
         for skill in self.skills:
             result = await skill.handle_nlu_result(nlu_result)
 
             if result is not None:
-                return result
+                return skill, result
+
+        return None, None
 
-        return None
+    def get_metrics(self) -> dict:
+        return {intent_name: cache.get_metrics() for intent_name, cache in self.result_caches.items()}
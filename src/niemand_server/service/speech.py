@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict
+from xml.sax.saxutils import escape
+
+import azure.cognitiveservices.speech as speechsdk
+
+from ..audio import split_text, synthesize_chunked, OutputFormat, OUTPUT_FORMATS, AdpcmDecoder, OpusDecoder, \
+    DecodeStats, INPUT_BYTES_PER_SECOND
+
+DEFAULT_OUTPUT_FORMAT = OUTPUT_FORMATS["wav"]
+
+INPUT_FORMATS = ("pcm", "adpcm", "opus")
+# Compressed input formats and their decoders, the recognizers are always fed with PCM
+DECODERS = {
+    "adpcm": AdpcmDecoder,
+    "opus": OpusDecoder,
+}
+
+
+class AudioInput:
+    """
+    Push stream of a recognizer fed with audio in one of the input formats. Compressed audio is decoded here frame by
+    frame as it arrives, so its CPU cost can be measured.
+    """
+
+    def __init__(self, input_format: str, stats: DecodeStats | None):
+        self.stats = stats
+        self.decoder = DECODERS[input_format]() if input_format in DECODERS else None
+        self.stream = speechsdk.audio.PushAudioInputStream()
+
+    def write(self, data: bytes):
+        if self.decoder is not None:
+            # Thread time, the threads of the speech SDK must not count
+            start = time.thread_time()
+            data = self.decoder.decode(data)
+            self.stats.record(len(data) / INPUT_BYTES_PER_SECOND, time.thread_time() - start)
+
+        self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+
+class RecognitionSession:
+    """
+    A push stream feeding a recognizer in continuous recognition. The recognizer stays warm for the whole session and
+    every recognized phrase is put into the phrases queue, None marks the end of the session.
+    """
+
+    def __init__(self, speech_config: speechsdk.SpeechConfig, audio_input: AudioInput, loop: asyncio.AbstractEventLoop):
+        self.logger = logging.getLogger(__name__)
+        self.loop = loop
+        self.audio_input = audio_input
+        self.recognizer = speechsdk.SpeechRecognizer(
+            speech_config=speech_config,
+            audio_config=speechsdk.audio.AudioConfig(stream=audio_input.stream),
+        )
+        self.phrases: asyncio.Queue[str | None] = asyncio.Queue()
+        self.connection = speechsdk.Connection.from_recognizer(self.recognizer)
+        self.created = time.monotonic()
+        self.healthy = True
+
+        # Callbacks are called from the threads of the speech SDK
+        self.recognizer.recognized.connect(self.on_recognized)
+        self.recognizer.canceled.connect(self.on_canceled)
+        self.recognizer.session_stopped.connect(lambda evt: self.put_phrase(None))
+        self.connection.disconnected.connect(self.on_disconnected)
+
+    def put_phrase(self, phrase: str | None):
+        self.loop.call_soon_threadsafe(self.phrases.put_nowait, phrase)
+
+    def on_recognized(self, evt):
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+            self.put_phrase(evt.result.text)
+
+    def on_canceled(self, evt):
+        self.logger.error(f"Azure CANCELED {evt}")
+        self.healthy = False
+        self.put_phrase(None)
+
+    def on_disconnected(self, evt):
+        self.healthy = False
+
+    def connect(self):
+        # Blocking, opens the connection to the service before any audio arrives
+        self.connection.open(True)
+
+    def discard(self):
+        # Blocking, for sessions that were never started
+        self.audio_input.close()
+        self.connection.close()
+
+    async def start(self):
+        await asyncio.to_thread(lambda: self.recognizer.start_continuous_recognition_async().get())
+
+    def write(self, data: bytes):
+        self.audio_input.write(data)
+
+    async def stop(self):
+        self.audio_input.close()
+        await asyncio.to_thread(lambda: self.recognizer.stop_continuous_recognition_async().get())
+
+
+class SpeechService:
+    CHUNK_SIZE = 4096
+    # Long texts are synthesized in chunks of whole sentences, in parallel
+    TTS_CHUNK_CHARS = 400
+
+    def __init__(self, access_token: str | None, region: str | None, language: str, voice: str, tts_parallelism: int):
+        self.logger = logging.getLogger(__name__)
+        self.access_token = access_token
+        self.region = region
+        self.language = language
+        self.voice = voice
+        self.tts_parallelism = tts_parallelism
+        self.decode_stats: Dict[str, DecodeStats] = {input_format: DecodeStats() for input_format in DECODERS}
+
+    def create_speech_config(self, output_format: OutputFormat = DEFAULT_OUTPUT_FORMAT) -> speechsdk.SpeechConfig:
+        speech_config = speechsdk.SpeechConfig(subscription=self.access_token, region=self.region)
+        speech_config.speech_recognition_language = self.language
+        speech_config.speech_synthesis_voice_name = self.voice
+        speech_config.set_speech_synthesis_output_format(
+            getattr(speechsdk.SpeechSynthesisOutputFormat, output_format.azure_format)
+        )
+        return speech_config
+
+    def create_audio_input(self, input_format: str) -> AudioInput:
+        return AudioInput(input_format, self.decode_stats.get(input_format))
+
+    def create_recognition_session(
+            self,
+            input_format: str = "pcm",
+            loop: asyncio.AbstractEventLoop | None = None,
+    ) -> RecognitionSession:
+        return RecognitionSession(
+            self.create_speech_config(),
+            self.create_audio_input(input_format),
+            loop or asyncio.get_running_loop(),
+        )
+
+    def get_metrics(self) -> dict:
+        return dict(decoding={input_format: stats.get_metrics() for input_format, stats in self.decode_stats.items()})
+
+    def create_synthesizer(self, output_format: OutputFormat = DEFAULT_OUTPUT_FORMAT) -> speechsdk.SpeechSynthesizer:
+        # Without an audio config the audio is only returned, not played on the server
+        return speechsdk.SpeechSynthesizer(speech_config=self.create_speech_config(output_format), audio_config=None)
+
+    def get_ssml(self, text: str) -> str:
+        return (
+            f"<speak version='1.0' xml:lang='{self.language}'><voice name='{self.voice}'>"
+            f"<prosody rate='20%'>{escape(text)}</prosody></voice></speak>"
+        )
+
+    async def synthesize(
+            self,
+            text: str,
+            synthesizer: speechsdk.SpeechSynthesizer | None = None,
+            output_format: OutputFormat = DEFAULT_OUTPUT_FORMAT,
+    ) -> bytes:
+        synthesizer = synthesizer or self.create_synthesizer(output_format)
+        result = await asyncio.to_thread(lambda: synthesizer.speak_ssml_async(self.get_ssml(text)).get())
+        return result.audio_data
+
+    def synthesize_chunked(self, text: str, output_format: OutputFormat = DEFAULT_OUTPUT_FORMAT) -> AsyncIterator[bytes]:
+        # Azure synthesizes every format natively. A synthesizer handles one text at a time, every chunk gets its own.
+        chunks = split_text(text, self.TTS_CHUNK_CHARS)
+        return synthesize_chunked(
+            chunks,
+            lambda chunk: self.synthesize(chunk, output_format=output_format),
+            self.tts_parallelism,
+            output_format.create_stitcher,
+        )
+
+    async def stream_synthesis(self, text: str, synthesizer: speechsdk.SpeechSynthesizer) -> AsyncIterator[bytes]:
+        """
+        Yields the audio while it is synthesized, the first chunk arrives long before the whole text is done.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue[bytes | None] = asyncio.Queue()
+
+        def synthesize():
+            try:
+                result = synthesizer.start_speaking_ssml_async(self.get_ssml(text)).get()
+                stream = speechsdk.AudioDataStream(result)
+                buffer = bytes(self.CHUNK_SIZE)
+
+                while (size := stream.read_data(buffer)) > 0:
+                    loop.call_soon_threadsafe(chunks.put_nowait, buffer[:size])
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        synthesis = asyncio.ensure_future(asyncio.to_thread(synthesize))
+
+        while (chunk := await chunks.get()) is not None:
+            yield chunk
+
+        await synthesis
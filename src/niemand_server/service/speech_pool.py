@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+from .speech import SpeechService, RecognitionSession
+
+
+class RecognizerPool:
+    """
+    Keeps recognition sessions with an open connection to the speech service ready, so a new connection can start
+    streaming audio right away. Every input format that was asked for once is kept topped up to the pool size.
+    Sessions that lost their connection or are older than max_age are replaced, a session is only used once.
+    """
+
+    def __init__(self, speech_service: SpeechService, size: int, max_age: int):
+        self.logger = logging.getLogger(__name__)
+        self.speech_service = speech_service
+        self.size = size
+        self.max_age = max_age
+        self.idle: Dict[str, Deque[RecognitionSession]] = {"pcm": deque()}
+        # Sessions taken out of the pool unused, discarded by the next top-up instead of on the request path
+        self.stale: List[RecognitionSession] = []
+        self.top_up_task: asyncio.Task | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self.failures = 0
+        self.acquire_time = 0.0
+
+    def is_usable(self, session: RecognitionSession) -> bool:
+        return session.healthy and time.monotonic() - session.created < self.max_age
+
+    async def create_session(self, input_format: str) -> RecognitionSession:
+        loop = asyncio.get_running_loop()
+
+        def create():
+            session = self.speech_service.create_recognition_session(input_format, loop)
+            session.connect()
+            return session
+
+        return await asyncio.to_thread(create)
+
+    async def acquire(self, input_format: str) -> RecognitionSession:
+        start = time.perf_counter()
+        idle = self.idle.setdefault(input_format, deque())
+        session = None
+
+        while len(idle) > 0:
+            candidate = idle.popleft()
+
+            if self.is_usable(candidate):
+                session = candidate
+                break
+
+            self.stale.append(candidate)
+
+        if session is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            session = self.speech_service.create_recognition_session(input_format)
+
+        self.acquire_time += time.perf_counter() - start
+        self.schedule_top_up()
+        return session
+
+    def schedule_top_up(self) -> asyncio.Task | None:
+        # Only one top-up runs at a time, two of them would both fill the pool to its size
+        if self.size > 0 and (self.top_up_task is None or self.top_up_task.done()):
+            self.top_up_task = asyncio.create_task(self.top_up())
+
+        return self.top_up_task
+
+    async def discard_stale(self):
+        while len(self.stale) > 0:
+            self.recycled += 1
+            await asyncio.to_thread(self.stale.pop().discard)
+
+    async def top_up(self):
+        await self.discard_stale()
+
+        # Formats can be added and sessions taken while this waits for the speech SDK
+        done = set()
+
+        while (input_format := next((name for name in self.idle if name not in done), None)) is not None:
+            idle = self.idle[input_format]
+            done.add(input_format)
+
+            for session in [session for session in idle if not self.is_usable(session)]:
+                idle.remove(session)
+                self.stale.append(session)
+
+            await self.discard_stale()
+
+            while len(idle) < self.size:
+                try:
+                    idle.append(await self.create_session(input_format))
+                except Exception as e:
+                    self.failures += 1
+                    self.logger.warning(f"Could not prepare a recognizer for {input_format}: {e!r}")
+                    break
+
+    async def close(self):
+        if self.top_up_task is not None:
+            self.top_up_task.cancel()
+
+            try:
+                await self.top_up_task
+            except asyncio.CancelledError:
+                pass
+
+        for idle in self.idle.values():
+            self.stale.extend(idle)
+            idle.clear()
+
+        await self.discard_stale()
+
+    def get_metrics(self) -> dict:
+        acquired = self.hits + self.misses
+        return dict(
+            size=self.size,
+            idle={input_format: len(idle) for input_format, idle in self.idle.items()},
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / acquired if acquired > 0 else None,
+            average_acquire_ms=self.acquire_time / acquired * 1000 if acquired > 0 else None,
+            recycled=self.recycled,
+            failures=self.failures,
+        )
@@ -0,0 +1,64 @@
+import csv
+import logging
+import math
+from typing import Dict, List, Tuple
+
+from .train import Station, Location
+from ..util import distance
+
+
+class StationIndex:
+    """
+    Grid index over a station dataset. The dataset is a CSV file with the columns id, name, latitude and longitude,
+    where id is the IBNR of the station as used by the DB REST API.
+    """
+
+    # Grid cells are about 2 km high, so the 3x3 neighbourhood of a cell always covers max_distance
+    CELL_SIZE = 0.02
+
+    def __init__(self, stations: List[Station], max_distance: float = 2000):
+        self.max_distance = max_distance
+        self.cells: Dict[Tuple[int, int], List[Station]] = {}
+
+        for station in stations:
+            self.cells.setdefault(self.get_cell(station.location.latitude, station.location.longitude), []).append(station)
+
+    @classmethod
+    def from_file(cls, path: str) -> "StationIndex":
+        with open(path, "rt", encoding="utf-8", newline="") as f:
+            stations = [
+                Station(
+                    id=row['id'],
+                    name=row['name'],
+                    location=Location(latitude=float(row['latitude']), longitude=float(row['longitude'])),
+                ) for row in csv.DictReader(f)
+            ]
+
+        logging.getLogger(__name__).info(f"Loaded {len(stations)} stations into the station index")
+        return cls(stations)
+
+    def get_cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.CELL_SIZE), math.floor(longitude / self.CELL_SIZE)
+
+    def nearest(self, location: Tuple[float, float], count: int) -> List[Station]:
+        lat_cell, lon_cell = self.get_cell(*location)
+
+        # Longitude cells shrink towards the poles, search wide enough to still cover max_distance
+        lon_span = math.ceil(1 / max(math.cos(math.radians(location[0])), 0.1))
+
+        candidates = []
+
+        for lat_offset in (-1, 0, 1):
+            for lon_offset in range(-lon_span, lon_span + 1):
+                for station in self.cells.get((lat_cell + lat_offset, lon_cell + lon_offset), ()):
+                    station_distance = distance(location, (station.location.latitude, station.location.longitude))
+
+                    if station_distance <= self.max_distance:
+                        candidates.append((station_distance, station))
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [station for _, station in candidates[:count]]
+
+
+def load_station_index(path: str | None) -> StationIndex | None:
+    return StationIndex.from_file(path) if path else None
@@ -1,8 +1,12 @@
+import logging
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Tuple, List
 
 import aiohttp
 
+from .cache import TtlCache, SingleFlight
+from ..util import geohash
+
 @dataclass
 class Location:
     latitude: float
@@ -24,10 +28,34 @@ class Trip:
 
 
 class TrainService:
-    def __init__(self, db_rest_url: str):
+    # Cells of geohash precision 7 are about 150 m wide, close enough to share the nearby stations
+    STATION_CELL_PRECISION = 7
+    NEARBY_STATION_COUNT = 8
+
+    def __init__(self, db_rest_url: str, station_index, departures_cache_ttl: int):
+        self.logger = logging.getLogger(__name__)
         self.db_rest_url = db_rest_url
+        self.station_index = station_index
+        self.nearby_stations: TtlCache[str, List[Station]] = TtlCache(ttl=24 * 60 * 60, max_size=1024)
+        self.departures: TtlCache[str, List[Trip]] = TtlCache(ttl=departures_cache_ttl, max_size=256)
+        self.departure_fetches: SingleFlight[str, List[Trip]] = SingleFlight()
+
+    async def get_stations(self, location: Tuple[float, float]) -> List[Station]:
+        cell = geohash(location[0], location[1], self.STATION_CELL_PRECISION)
+        stations = self.nearby_stations.get(cell)
+
+        if stations is None:
+            stations = self.station_index.nearest(location, self.NEARBY_STATION_COUNT) if self.station_index else []
+
+            if len(stations) == 0:
+                self.logger.debug(f"No indexed station near {location}, asking the DB REST API")
+                stations = await self.fetch_stations(location)
+
+            self.nearby_stations.put(cell, stations)
 
-    async def get_stations(self, location: Tuple[float, float]):
+        return stations
+
+    async def fetch_stations(self, location: Tuple[float, float]) -> List[Station]:
         async with aiohttp.ClientSession() as session:
             url = f'{self.db_rest_url}/locations/nearby?poi=false&addresses=false&latitude={location[0]}&longitude={location[1]}'
             result = await session.get(url=url)
@@ -44,12 +72,20 @@ class TrainService:
                 ) for item in items
             ]
 
-    async def get_departures(self, station_id: str):
+    async def get_departures(self, station_id: str) -> List[Trip]:
+        trips = self.departures.get(station_id)
+
+        if trips is None:
+            trips = await self.departure_fetches.run(station_id, lambda: self.fetch_departures(station_id))
+
+        return trips
+
+    async def fetch_departures(self, station_id: str) -> List[Trip]:
         async with aiohttp.ClientSession() as session:
             result = await session.get(url=f'{self.db_rest_url}/stops/{station_id}/departures?duration=30')
             result.raise_for_status()
             items = (await result.json())['departures']
-            return [
+            trips = [
                 Trip(
                     plannedWhen=item['plannedWhen'],
                     delay=item['delay'],
@@ -58,3 +94,6 @@ class TrainService:
                     platform=item['platform'],
                 ) for item in items
             ]
+
+        self.departures.put(station_id, trips)
+        return trips
@@ -1,5 +1,39 @@
+import functools
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Tuple
+
 import aiohttp
 
+from .cache import SingleFlight
+from .deadline import client_timeout
+
+# Default of arguments for which None is a valid value, such as a missing via station
+DEFAULT: Any = object()
+
+
+@dataclass(frozen=True)
+class Departure:
+    train: str
+    scheduled_departure: str
+    delay: int
+    is_cancelled: bool
+    platform: str | None
+    scheduled_platform: str | None
+    messages: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class DepartureBoard:
+    departures: Tuple[Departure, ...]
+
+
+@dataclass
+class CachedBoard:
+    board: DepartureBoard
+    etag: str | None
+    fetched_at: float
+
 
 class TrainCheckService:
     ARTICLE_MAP = {
@@ -14,9 +48,15 @@ class TrainCheckService:
         "Bus SEV": "der"
     }
 
-    def __init__(self, station_from, station_via):
+    def __init__(self, station_from, station_via, cache_ttl: int):
         self.station_from = station_from
         self.station_via = station_via
+        self.cache_ttl = cache_ttl
+        self.boards: Dict[Tuple[str, str | None], CachedBoard] = {}
+        self.fetches: SingleFlight[Tuple[str, str | None], DepartureBoard] = SingleFlight()
+
+        # Boards are immutable, so unchanged departures are rendered only once
+        self.render_departures = functools.lru_cache(maxsize=16)(self.render_departures)
 
     def get_article(self, train):
         transport_type = train[:train.index(" ")]
@@ -36,45 +76,86 @@ class TrainCheckService:
         hour, minute = time.split(':')
         return f'{hour} Uhr {minute}'
 
-    async def check_train(self):
-        url = f'https://dbf.finalrewind.org/{self.station_from}'
+    def parse_departures(self, data: dict) -> DepartureBoard:
+        return DepartureBoard(departures=tuple(
+            Departure(
+                train=departure['train'],
+                scheduled_departure=departure['scheduledDeparture'],
+                delay=departure['delayDeparture'] or 0,
+                is_cancelled=departure['isCancelled'] != 0,
+                platform=departure['platform'],
+                scheduled_platform=departure['scheduledPlatform'],
+                messages=tuple(message['text'] for message in departure['messages']['qos']),
+            ) for departure in data['departures']
+        ))
+
+    async def fetch_departures(self, station_from: str, station_via: str | None) -> DepartureBoard:
+        key = (station_from, station_via)
+        cached = self.boards.get(key)
+
+        url = f'https://dbf.finalrewind.org/{station_from}'
 
         params = dict(
-            via=self.station_via,
+            via=station_via,
             mode="json",
             version="3"
         )
-        async with aiohttp.ClientSession() as session:
-            resp = await session.get(url, params=params)
-            data = await resp.json()
+        params = {k: v for k, v in params.items() if v is not None}
+        headers = {'If-None-Match': cached.etag} if cached is not None and cached.etag is not None else {}
 
-        departures = data['departures']
+        async with aiohttp.ClientSession(timeout=client_timeout()) as session:
+            async with session.get(url, params=params, headers=headers) as resp:
+                if resp.status == 304:
+                    board = cached.board
+                else:
+                    resp.raise_for_status()
+                    board = self.parse_departures(await resp.json())
+
+                self.boards[key] = CachedBoard(board=board, etag=resp.headers.get('ETag'), fetched_at=time.monotonic())
+
+        return board
+
+    async def get_departures(self, station_from: str | None = None, station_via: str | None = DEFAULT) -> DepartureBoard:
+        station_from = station_from or self.station_from
+        station_via = self.station_via if station_via is DEFAULT else station_via
+        cached = self.boards.get((station_from, station_via))
+
+        if cached is not None and time.monotonic() - cached.fetched_at < self.cache_ttl:
+            return cached.board
 
-        if len(departures) == 0:
+        return await self.fetches.run(
+            (station_from, station_via),
+            lambda: self.fetch_departures(station_from, station_via)
+        )
+
+    def render_departures(self, board: DepartureBoard) -> str:
+        if len(board.departures) == 0:
             return 'In nächster Zeit fahren keine Bahnen.'
 
-        result = ""
+        result = []
 
-        for departure in departures[:2]:
-            result += "{} {} um {} ".format(
-                self.get_article(departure['train']),
-                self.fix_one(departure['train']),
-                self.convert_time(departure['scheduledDeparture'])
-            )
+        for departure in board.departures[:2]:
+            result.append("{} {} um {} ".format(
+                self.get_article(departure.train),
+                self.fix_one(departure.train),
+                self.convert_time(departure.scheduled_departure)
+            ))
 
-            if departure['isCancelled'] == 0:
-                if departure['delayDeparture'] < 3:
-                    result += "ist pünktlich. "
+            if not departure.is_cancelled:
+                if departure.delay < 3:
+                    result.append("ist pünktlich. ")
                 else:
-                    result += "hat {} Minuten Verspätung. ".format(
-                        departure['delayDeparture']
-                    )
-                for qos_message in departure['messages']['qos']:
-                    result += "{}. ".format(qos_message['text'])
-
-                if departure['platform'] != departure['scheduledPlatform']:
-                    result += "Heute von Gleis {}. ".format(departure['platform'])
+                    result.append("hat {} Minuten Verspätung. ".format(departure.delay))
+
+                for qos_message in departure.messages:
+                    result.append("{}. ".format(qos_message))
+
+                if departure.platform != departure.scheduled_platform:
+                    result.append("Heute von Gleis {}. ".format(departure.platform))
             else:
-                result += "fällt aus. "
+                result.append("fällt aus. ")
+
+        return "".join(result)
 
-        return result
+    async def check_train(self, station_from: str | None = None, station_via: str | None = DEFAULT) -> str:
+        return self.render_departures(await self.get_departures(station_from, station_via))
@@ -1,23 +1,121 @@
+import logging
+from collections import Counter
+from dataclasses import dataclass
 from datetime import datetime
+from typing import List
 
 import aiohttp
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from .cache import TtlCache, SingleFlight
+from .deadline import client_timeout
+from .resilience import RequestBudget
+
+
+def is_weather_node(name: str, attrs: dict) -> bool:
+    if name != "div":
+        return False
+
+    return attrs.get("id") == "nowcast-card-temperature" or "report-text" in attrs.get("class", "").split()
+
+
+# Only the forecast texts and the current temperature are kept while parsing, the rest of the page is skipped
+WEATHER_STRAINER = SoupStrainer(is_weather_node)
+
+
+@dataclass
+class WeatherPage:
+    forecasts: List[str]
+    temperature: str | None
+    fetched_at: datetime
 
 
 class WeatherService:
-    async def download_weather(self, place: str) -> BeautifulSoup:
+    # Popularity decays with every prefetch run (once a minute), so places not asked for anymore drop out of the top
+    POPULARITY_DECAY = 0.99
+    # Popular pages are refreshed this many seconds before they expire
+    PREFETCH_MARGIN = 120
+
+    def __init__(self, cache_ttl: int, prefetch_top_n: int, request_budget: int):
+        self.logger = logging.getLogger(__name__)
+        self.pages: TtlCache[str, WeatherPage] = TtlCache(cache_ttl)
+        self.downloads: SingleFlight[str, WeatherPage] = SingleFlight()
+        self.prefetch_top_n = prefetch_top_n
+        self.budget = RequestBudget(request_budget)
+        self.popularity: Counter[str] = Counter()
+
+    def record_query(self, place: str):
+        self.popularity[place.lower()] += 1
+
+    async def prefetch_popular_places(self):
+        for place, _ in self.popularity.most_common(self.prefetch_top_n):
+            age = self.pages.age(place)
+
+            if age is not None and age < self.pages.ttl - self.PREFETCH_MARGIN:
+                continue
+
+            # Prefetching is optional, live queries may still use up the remaining budget
+            if self.budget.remaining() == 0:
+                self.logger.info("Weather request budget exhausted, skipping prefetch")
+                break
+
+            try:
+                await self.refresh_weather(place)
+            except aiohttp.ClientError as e:
+                self.logger.warning(f"Prefetching weather for {place} failed: {e}")
+
+        for place in self.popularity:
+            self.popularity[place] *= self.POPULARITY_DECAY
+
+    async def download_weather(self, place: str) -> WeatherPage:
         url = f"https://www.wetteronline.de/wetter/{place}"
+        self.budget.record()
 
-        async with aiohttp.ClientSession() as session:
-            resp = await session.get(url)
-            html_doc = await resp.text()
+        async with aiohttp.ClientSession(timeout=client_timeout()) as session:
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                html_doc = await resp.text()
 
-        return BeautifulSoup(html_doc, 'html.parser')
+        return self.parse_weather(html_doc)
 
-    async def get_forecast(self, place: str, date: datetime | None = None) -> str | None:
-        soup = await self.download_weather(place)
+    def parse_weather(self, html_doc: str) -> WeatherPage:
+        soup = BeautifulSoup(html_doc, 'html.parser', parse_only=WEATHER_STRAINER)
+
+        temperature_card = soup.find("div", id="nowcast-card-temperature")
+        temperature = temperature_card.find("div") if temperature_card is not None else None
+
+        return WeatherPage(
+            forecasts=[node.text for node in soup.find_all("div", class_="report-text")],
+            temperature=temperature.text if temperature is not None else None,
+            fetched_at=datetime.now(),
+        )
+
+    async def refresh_weather(self, place: str) -> WeatherPage:
+        place = place.lower()
+
+        async def download_and_store():
+            page = await self.download_weather(place)
 
-        forecast_texts = soup.find_all("div", class_="report-text")
+            # A page without any weather (changed layout, unknown place) is not kept, the next query tries again
+            if len(page.forecasts) > 0 or page.temperature is not None:
+                self.pages.put(place, page)
+            else:
+                self.logger.warning(f"No weather found on the page for {place}")
+
+            return page
+
+        return await self.downloads.run(place, download_and_store)
+
+    async def get_weather(self, place: str) -> WeatherPage:
+        page = self.pages.get(place.lower())
+
+        if page is None:
+            page = await self.refresh_weather(place)
+
+        return page
+
+    async def get_forecast(self, place: str, date: datetime | None = None) -> str | None:
+        forecast_texts = (await self.get_weather(place)).forecasts
 
         idx = 0
 
@@ -25,10 +123,9 @@ class WeatherService:
             idx = 1
 
         if len(forecast_texts) > 1:
-            return forecast_texts[idx].text
+            return forecast_texts[idx]
         else:
             return None
 
-    async def get_current_temperature(self, place: str) -> str:
-        soup = await self.download_weather(place)
-        return soup.find("div", id="nowcast-card-temperature").find("div").text
+    async def get_current_temperature(self, place: str) -> str | None:
+        return (await self.get_weather(place)).temperature
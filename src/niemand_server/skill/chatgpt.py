@@ -1,20 +1,78 @@
-from openai import OpenAI
+import asyncio
+from typing import List
+
+from openai import OpenAI, APITimeoutError
 from .skill import NiemandSkill, SkillResult, ProcessResponseContext
+from ..service.cache import TtlCache, SingleFlight
+from ..service.deadline import remaining_or
+from ..service.intent_matcher import tokenize
+
+# Questions containing one of these words or phrases depend on when they are asked and are never cached. Whole words
+# are compared, so e.g. "uhrwerk" or "zeitalter" are not affected.
+TIME_SENSITIVE_WORDS = {
+    "heute", "heutige", "heutigen", "morgen", "übermorgen", "gestern", "jetzt", "gerade", "momentan", "derzeit",
+    "derzeitige", "derzeitigen", "aktuell", "aktuelle", "aktuellen", "aktuelles", "noch", "bald", "neu", "neue",
+    "neuen", "neues", "neueste", "neuesten", "neuste", "neusten", "letzte", "letzten", "letztes", "nächste",
+    "nächsten", "nächstes", "alt", "uhr", "uhrzeit", "spät", "datum", "wann", "wochentag", "wetter", "temperatur",
+    "news", "nachrichten", "kurs", "preis", "preise", "spielstand", "ergebnis", "ergebnisse", "live",
+}
+# Questions about who holds an office change with elections and appointments
+TIME_SENSITIVE_PHRASES = ("wer ist", "wer sind", "wer war zuletzt")
+
+
+def is_time_sensitive(tokens: List[str]) -> bool:
+    text = f" {' '.join(tokens)} "
+    return any(token in TIME_SENSITIVE_WORDS for token in tokens) or any(
+        f" {phrase} " in text for phrase in TIME_SENSITIVE_PHRASES
+    )
 
 
 class ChatGptSkill(NiemandSkill):
     client: OpenAI
 
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, cache_ttl: int, cache_size: int):
         self.client = OpenAI(api_key=openai_api_key)
+        # Answers by normalized question, a TTL of 0 disables the cache for the household
+        self.cache_ttl = cache_ttl
+        self.answers: TtlCache[str, str] = TtlCache(cache_ttl, cache_size)
+        self.answer_flights: SingleFlight[str, str] = SingleFlight()
+        self.bypassed = 0
+
+    async def ask(self, utterance: str) -> str | None:
+        try:
+            # The client is synchronous, run it in a thread so it does not block the event loop
+            response = await asyncio.to_thread(
+                self.client.chat.completions.create,
+                timeout=remaining_or(60),
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a helpful voice assistant that answers in german and gives compact but meaningful answers."},
+                    {"role": "user", "content": utterance},
+                ]
+            )
+        except APITimeoutError as e:
+            raise TimeoutError("ChatGPT did not answer in time") from e
+
+        return response.choices[0].message.content
 
     async def handle_nlu_result(self, result: ProcessResponseContext) -> SkillResult | None:
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful voice assistant that answers in german and gives compact but meaningful answers."},
-                {"role": "user", "content": result.utterance},
-            ]
-        )
-
-        return SkillResult(response=response.choices[0].message.content)
+        tokens = tokenize(result.utterance)
+
+        if self.cache_ttl <= 0 or is_time_sensitive(tokens):
+            self.bypassed += 1
+            return SkillResult(response=await self.ask(result.utterance))
+
+        key = " ".join(tokens)
+        answer = self.answers.get(key)
+
+        if answer is None:
+            # The same question asked twice at once costs a single request
+            answer = await self.answer_flights.run(key, lambda: self.ask(result.utterance))
+
+            if answer is not None:
+                self.answers.put(key, answer)
+
+        return SkillResult(response=answer)
+
+    def get_metrics(self) -> dict:
+        return dict(answer_cache=self.answers.get_metrics(), bypassed=self.bypassed)
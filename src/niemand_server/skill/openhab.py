@@ -1,6 +1,7 @@
 import logging
 from typing import List, Tuple
 
+import aiohttp
 from genderdeterminator import GenderDeterminator, Case
 
 from ..service.openhab import OpenhabService, Item
@@ -10,6 +11,7 @@ UNKNOWN_DEVICE = "Ich habe nicht verstanden, welches Gerät du {} möchtest."
 UNKNOWN_TEMPERATURE = "Die Temperatur {} ist unbekannt."
 UNKNOWN_PROPERTY = "Ich habe nicht verstanden, welche Eigenschaft verändert werden soll."
 FEATURE_NOT_IMPLEMENTED = "Diese Funktionalität ist aktuell nicht implementiert."
+DEVICES_NOT_REACHED = "Das hat leider nicht geklappt, die Geräte haben nicht reagiert."
 
 
 class OpenHABSkill(NiemandSkill):
@@ -108,7 +110,11 @@ class OpenHABSkill(NiemandSkill):
                     if point_item.semantics == "Point_Control_Switch":
                         devices.add(point_item)
 
-        await self.openhab.send_command_to_devices(devices, command)
+        try:
+            await self.openhab.send_command_to_devices(devices, command)
+        except aiohttp.ClientError:
+            return False, DEVICES_NOT_REACHED
+
         result_sentence = self.generate_switch_result_sentence(list(relevant_devices), command)
 
         return True, result_sentence
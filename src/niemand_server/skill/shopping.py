@@ -1,14 +1,17 @@
-import os
-from .skill import NiemandSkill, SkillResult, ProcessResponseContext, get_entity_by_name
-from ..service.shopping import ShoppingListService
+from typing import List
+
+import aiohttp
+
+from .skill import NiemandSkill, SkillResult, ProcessResponseContext, get_entities_by_name
+from ..service.shopping import ShoppingListService, ShoppinglistItem
+
+SHOPPING_LIST_NOT_REACHED = "Das hat leider nicht geklappt, nicht alles konnte auf die Einkaufsliste geschrieben werden."
 
 
 class ShoppingSkill(NiemandSkill):
 
-    def __init__(self):
-        tandoor_server_url = os.environ.get("TANDOOR_SERVER_URL")
-        tandoor_access_token = os.environ.get("TANDOOR_ACCESS_TOKEN")
-        self.shopping = ShoppingListService(tandoor_server_url, tandoor_access_token)
+    def __init__(self, shopping_list_service: ShoppingListService):
+        self.shopping = shopping_list_service
 
     async def init(self):
         pass
@@ -20,26 +23,48 @@ class ShoppingSkill(NiemandSkill):
         intent_name = result.nlu.intent.name
 
         if intent_name == "shopping_list_add_item":
-            result = await self.add_shopping_list_item(result)
-            return SkillResult(response=result)
+            try:
+                response = await self.add_shopping_list_items(result)
+            except aiohttp.ClientError:
+                return SkillResult(response=SHOPPING_LIST_NOT_REACHED, success=False)
+
+            return SkillResult(response=response)
         else:
             return None
 
-    async def add_shopping_list_item(self, context: ProcessResponseContext) -> str:
-        unit_entity = get_entity_by_name(context.nlu.entities, 'shopping_list_unit')
-        item_entity = get_entity_by_name(context.nlu.entities, 'shopping_list_item')
-        amount_entity = get_entity_by_name(context.nlu.entities, 'number')
+    def get_items(self, context: ProcessResponseContext) -> List[ShoppinglistItem]:
+        item_entities = get_entities_by_name(context.nlu.entities, 'shopping_list_item')
+        unit_entities = get_entities_by_name(context.nlu.entities, 'shopping_list_unit')
+        amount_entities = get_entities_by_name(context.nlu.entities, 'number')
+
+        items = []
+
+        for idx, item_entity in enumerate(item_entities):
+            # Amounts and units can only be assigned to the items if every item has its own one
+            amount = amount_entities[idx].value if len(amount_entities) == len(item_entities) else None
+            unit = unit_entities[idx].value if len(unit_entities) == len(item_entities) else None
+
+            if isinstance(amount, float) and amount.is_integer():
+                amount = int(amount)
 
-        if item_entity is None:
+            description = " ".join(str(part) for part in (amount, unit) if part is not None)
+            items.append(ShoppinglistItem(name=str(item_entity.value), description=description))
+
+        return items
+
+    async def add_shopping_list_items(self, context: ProcessResponseContext) -> str:
+        items = self.get_items(context)
+
+        if len(items) == 0:
             return "Ich habe nicht verstanden was du auf die Einkaufsliste schreiben möchtest"
 
-        await self.shopping.add_item_to_shopping_list(
-            item_entity.value,
-            unit_entity.value if unit_entity is not None else None,
-            amount_entity.value if amount_entity is not None else None
-        )
+        await self.shopping.add_items_to_shopping_list(items)
+
+        spoken_items = [f"{item.description} {item.name}".strip() for item in items]
+
+        if len(spoken_items) == 1:
+            spoken = spoken_items[0]
+        else:
+            spoken = f"{', '.join(spoken_items[:-1])} und {spoken_items[-1]}"
 
-        return f'Ich habe dir ' \
-               f'{amount_entity.value if amount_entity is not None else ""} ' \
-               f'{unit_entity.value if unit_entity is not None else ""} ' \
-               f'{item_entity.value} auf die Einkaufsliste geschrieben'
+        return f'Ich habe dir {spoken} auf die Einkaufsliste geschrieben'
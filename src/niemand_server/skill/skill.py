@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List
 
 from pydantic import BaseModel
 
@@ -8,6 +8,8 @@ from pydantic import BaseModel
 @dataclass
 class SkillResult:
     response: str
+    # Answers that only report a failure are not reused from the result cache
+    success: bool = True
 
 
 class NluProcessResponseIntent(BaseModel):
@@ -69,9 +71,17 @@ def get_entities_by_name(entities: List[NluProcessEntity], name: str) -> List[Nl
 
 
 class NiemandSkill(ABC):
+    # Intents whose results only depend on the intent and its entities, mapped to how many seconds they may be reused.
+    # Intents that change state must never be listed here.
+    cached_intents: Dict[str, int] = {}
+
     def intent_has_global_min_confidence(self, intent):
         return intent.confidence > 0.85
 
+    def handle_cached_result(self, result: ProcessResponseContext):
+        # Called instead of handle_nlu_result when a cached result is served
+        pass
+
     @abstractmethod
     async def handle_nlu_result(self, result: ProcessResponseContext) -> SkillResult | None:
         pass
@@ -3,6 +3,10 @@ from ..service.traincheck import TrainCheckService
 
 
 class TraincheckSkill(NiemandSkill):
+    cached_intents = {
+        "traincheck_check_train": 30,
+    }
+
     def __init__(self, traincheck_service: TrainCheckService):
         self.traincheck = traincheck_service
 
@@ -1,8 +1,15 @@
+import aiohttp
+
 from .skill import NiemandSkill, ProcessResponseContext, SkillResult, get_entity_by_name
 from ..service.weather import WeatherService
 
 
 class WeatherSkill(NiemandSkill):
+    cached_intents = {
+        "weather_get_forecast": 600,
+        "weather_get_temperature": 300,
+    }
+
     def __init__(self, weather_service: WeatherService, default_place: str):
         self.weather = weather_service
         self.default_place = default_place
@@ -24,24 +31,37 @@ class WeatherSkill(NiemandSkill):
             if temperature is not None:
                 return SkillResult(response=f"Aktuell beträgt die Außentemperatur {temperature} Grad.")
             else:
-                return SkillResult(response="Leider konnte ich die Außentemperatur nicht bestimmen.")
+                return SkillResult(response="Leider konnte ich die Außentemperatur nicht bestimmen.", success=False)
 
     async def get_weather_forecast_response(self, context: ProcessResponseContext):
         place = self.resolve_place(context)
 
-        forecast = await self.weather.get_forecast(place)
+        try:
+            forecast = await self.weather.get_forecast(place)
+        except aiohttp.ClientError:
+            forecast = None
+
+        if forecast is None:
+            return SkillResult(response="Leider konnte ich keine Wettervorhersage finden.", success=False)
 
         return SkillResult(response=forecast)
 
+    def handle_cached_result(self, result: ProcessResponseContext):
+        # Cached answers count towards the popularity of the place as well
+        self.resolve_place(result)
+
     def resolve_place(self, context: ProcessResponseContext) -> str:
         place = get_entity_by_name(context.nlu.entities, 'city')
 
-        if place is None:
-            return self.default_place
-        else:
-            return place.value
+        resolved_place = self.default_place if place is None else place.value
+        self.weather.record_query(resolved_place)
+
+        return resolved_place
 
-    async def get_current_temperature(self, context: ProcessResponseContext) -> str:
+    async def get_current_temperature(self, context: ProcessResponseContext) -> str | None:
         place = self.resolve_place(context)
-        temperature = await self.weather.get_current_temperature(place)
-        return temperature
\ No newline at end of file
+
+        try:
+            return await self.weather.get_current_temperature(place)
+        except aiohttp.ClientError:
+            return None
\ No newline at end of file
@@ -1,9 +1,57 @@
+import math
 from datetime import datetime, date
+from typing import Tuple
+
 from humanize import naturalday
 
+EARTH_RADIUS_M = 6_371_000
+
 
 def format_date(dt: datetime | date):
     if isinstance(dt, datetime):
         return f"{naturalday(dt.astimezone())} {dt.astimezone().strftime('%H:%M')}"
     else:
         return naturalday(dt)
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    result = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(result) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            result.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(result)
+
+
+def distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """
+    Distance in meters between two (latitude, longitude) points. Uses the equirectangular approximation, which is
+    precise enough for the few kilometers we compare.
+    """
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    y = math.radians(b[0] - a[0])
+    return math.hypot(x, y) * EARTH_RADIUS_M
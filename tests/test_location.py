@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from niemand_server.service.location import LocationService
+
+
+def position_message(geofence_ids):
+    return {"positions": [{
+        "deviceId": 7,
+        "deviceTime": "2026-10-19T10:00:00Z",
+        "accuracy": 5,
+        "latitude": 51.0,
+        "longitude": 7.0,
+        "geofenceIds": geofence_ids,
+    }]}
+
+
+class TraccarStandIn:
+    """
+    Local stand-in for the Traccar API: session login, geofences and the websocket. Every connection to the websocket
+    takes the next script from connections, a list of messages to push before the socket is closed.
+    """
+
+    def __init__(self, failed_logins=0, connections=None):
+        self.failed_logins = failed_logins
+        self.connections = list(connections or [])
+        self.logins = []
+        self.socket_cookies = []
+        self.done = asyncio.Event()
+
+        self.app = web.Application()
+        self.app.router.add_post("/api/session", self.session)
+        self.app.router.add_get("/api/geofences", self.geofences)
+        self.app.router.add_get("/api/socket", self.socket)
+        self.server = TestServer(self.app)
+
+    async def session(self, request):
+        self.logins.append(dict(await request.post()))
+
+        if len(self.logins) <= self.failed_logins:
+            return web.Response(status=500)
+
+        response = web.json_response({})
+        response.set_cookie("JSESSIONID", f"session-{len(self.logins)}")
+        return response
+
+    async def geofences(self, request):
+        return web.json_response([{"id": 3, "name": "Zuhause", "attributes": {"category": "home"}}])
+
+    async def socket(self, request):
+        self.socket_cookies.append(request.cookies.get("JSESSIONID"))
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        if len(self.connections) == 0:
+            self.done.set()
+            await asyncio.sleep(3600)
+
+        for message in self.connections.pop(0):
+            await ws.send_str(json.dumps(message))
+
+        await ws.close()
+        return ws
+
+
+async def run_listener(traccar: TraccarStandIn, service_check, on_update=None):
+    await traccar.server.start_server()
+    service = LocationService(str(traccar.server.make_url("")).rstrip("/"), "user@example.com", "secret", 600)
+
+    if on_update is not None:
+        service.add_listener(on_update)
+
+    listener = asyncio.create_task(service.listen())
+
+    try:
+        await asyncio.wait_for(traccar.done.wait(), 10)
+        await service_check(service)
+    finally:
+        listener.cancel()
+        await service.close()
+        await traccar.server.close()
+
+
+def test_login_and_position_updates():
+    traccar = TraccarStandIn(connections=[[position_message([]), position_message([3])]])
+    updates = []
+
+    async def check(service: LocationService):
+        location = await service.get_device_location(7)
+        assert location.geofence_name == "Zuhause"
+        assert location.geofence_category == "home"
+
+    async def on_update(device_id, location, previous):
+        updates.append((device_id, location.geofence_name, previous.geofence_name if previous else None))
+
+    asyncio.run(run_listener(traccar, check, on_update))
+
+    assert traccar.logins[0] == {"email": "user@example.com", "password": "secret"}
+    # The websocket is authenticated by the cookie of the login
+    assert traccar.socket_cookies[0] == "session-1"
+    assert updates == [("7", None, None), ("7", "Zuhause", None)]
+
+
+def test_reconnect_with_backoff(monkeypatch):
+    # Two failed logins, then a connection that is closed by the server, then one that stays open
+    traccar = TraccarStandIn(failed_logins=2, connections=[[]])
+    delays = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay, *args, **kwargs):
+        if delay >= 1:
+            delays.append(delay)
+            delay = 0
+
+        return await sleep(delay, *args, **kwargs)
+
+    monkeypatch.setattr(asyncio, "sleep", recording_sleep)
+
+    async def check(service: LocationService):
+        assert service.connected
+
+    asyncio.run(run_listener(traccar, check))
+
+    # The delay doubles after every failure and starts over once a connection was established
+    assert delays[:3] == [1, 2, 1]
+    assert len(traccar.logins) == 4